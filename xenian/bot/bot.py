@@ -6,13 +6,12 @@ from queue import Queue
 
 from telegram import Bot, TelegramError, Update
 from telegram.ext import CommandHandler, Filters, Updater, Dispatcher, JobQueue
-from telegram.ext.messagequeue import queuedmessage, MessageQueue
 from telegram.utils.request import Request
 
 import xenian.bot
-from xenian.bot.utils import get_self
+from xenian.bot.utils import MessageScheduler, get_self
 from .commands import BaseCommand
-from .settings import ADMINS, LOG_LEVEL, MODE, TELEGRAM_API_TOKEN
+from .settings import ADMINS, BOT_API, LOG_LEVEL, MESSAGE_SCHEDULER, MODE, TELEGRAM_API_TOKEN
 
 logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=LOG_LEVEL)
 logger = logging.getLogger(__name__)
@@ -32,31 +31,64 @@ def error(bot: Bot, update: Update, error: TelegramError):
 
 
 class MQBot(Bot):
+    """Bot sending all messages through a :class:`xenian.bot.utils.message_scheduler.MessageScheduler`
+
+    Sending methods return a :class:`xenian.bot.utils.message_scheduler.ScheduledPromise` and accept two further
+    keyword arguments: ``priority``, one of :class:`xenian.bot.utils.message_scheduler.Priority`, and ``queued=False``
+    to send the message directly.
+    """
+
     def __init__(self, *args, **kwargs):
         super(MQBot, self).__init__(*args, **kwargs)
-        self._is_messages_queued_default = True
-        self._msg_queue  = MessageQueue(all_burst_limit=2,
-                                        all_time_limit_ms=1024,
-                                        group_burst_limit=19,
-                                        group_time_limit_ms=6000)
+        self.message_scheduler = MessageScheduler(**MESSAGE_SCHEDULER)
+
     def __del__(self):
         try:
-            self._msg_queue.stop()
+            self.message_scheduler.stop()
         except:
             pass
 
-    @queuedmessage
-    def _message(self, *args, **kwargs):
-        return super(MQBot, self,)._message(*args, **kwargs)
+    def _message(self, url, data, *args, **kwargs):
+        # Messages sent via inline mode have no chat, each of them is paced on its own
+        chat_id = data.get('chat_id', None) or data.get('inline_message_id', None)
+        return self._schedule(super(MQBot, self)._message, (url, data) + args, kwargs, chat_id,
+                              url.rsplit('/', 1)[-1])
+
+    # These methods post to the Bot API directly instead of using _message
+    def send_media_group(self, *args, **kwargs):
+        return self._schedule(super(MQBot, self).send_media_group, args, kwargs, self._chat_id(args, kwargs),
+                              'sendMediaGroup')
+
+    def send_chat_action(self, *args, **kwargs):
+        return self._schedule(super(MQBot, self).send_chat_action, args, kwargs, self._chat_id(args, kwargs),
+                              'sendChatAction')
+
+    def delete_message(self, *args, **kwargs):
+        return self._schedule(super(MQBot, self).delete_message, args, kwargs, self._chat_id(args, kwargs),
+                              'deleteMessage')
+
+    def _schedule(self, function, args, kwargs, chat_id, method):
+        priority = kwargs.pop('priority', None)
+        if not kwargs.pop('queued', True):
+            return function(*args, **kwargs)
+
+        return self.message_scheduler.schedule(function, args, kwargs, chat_id=chat_id, method=method,
+                                               priority=priority)
+
+    @staticmethod
+    def _chat_id(args, kwargs):
+        return kwargs['chat_id'] if 'chat_id' in kwargs else args[0]
+
 
 def main():
     workers = 8
-    con_pool_size = workers + 4
+    con_pool_size = workers + MESSAGE_SCHEDULER['workers'] + 4
 
     job_queue = JobQueue()
 
     request = Request(con_pool_size=con_pool_size)
-    bot = MQBot(token=TELEGRAM_API_TOKEN, request=request)
+    bot = MQBot(token=TELEGRAM_API_TOKEN, request=request, base_url=BOT_API['base_url'],
+                base_file_url=BOT_API['base_file_url'])
     dispatcher = Dispatcher(bot, Queue(),
                            job_queue=job_queue,
                            workers=workers)
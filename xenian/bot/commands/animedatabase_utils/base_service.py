@@ -1,3 +1,6 @@
+from functools import partial
+
+
 class BaseService:
     type = 'base'
 
@@ -13,9 +16,20 @@ class BaseService:
         self.session = None
         self.tag_limit = None
         self.censored_tags = None
+        self.search_timeout = None
 
     def init_client(self):
         raise NotImplemented
 
+    def set_request_timeout(self, timeout: int or float):
+        """Give up requests of the client which do not get an answer in time
+
+        Args:
+            timeout (:obj:`int` or :obj:`float`): Timeout for connecting and for each read in sec
+        """
+        # pybooru sends all api calls through this requests session without a timeout of its own
+        session = self.client.client
+        session.request = partial(session.request, timeout=timeout)
+
     def init_session(self):
         raise NotImplemented
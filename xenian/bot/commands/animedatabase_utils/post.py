@@ -11,9 +11,12 @@ class Post:
         def __getattribute__(self, item):
             return self.post.get('')
 
-    def __init__(self, post: dict, media: str or IO or PhotoSize = None, caption: str = None, post_url: str = None):
+    def __init__(self, post: dict, media: str or IO or PhotoSize = None, caption: str = None, post_url: str = None,
+                 dimensions: tuple = None, file_size: int = None):
         self.post = post
         self.post_url = post_url
+        self.dimensions = dimensions  # Width and height of the media, if known
+        self.file_size = file_size  # Size of the media in bytes, if known
         self._telegram = InputMediaPhoto(media, caption)
         self._file = None
 
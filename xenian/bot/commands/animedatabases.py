@@ -1,15 +1,23 @@
 import json
+import multiprocessing
 import os
 import re
-import zipfile
+import time
 from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import ExitStack, contextmanager
 from copy import deepcopy
+from tempfile import NamedTemporaryFile, TemporaryDirectory
+from threading import Lock
 from typing import Any, Callable, Iterable
 
 import requests
+from PIL import Image
 from requests.exceptions import MissingSchema
-from telegram import Bot, ChatAction, InputFile, InputMediaPhoto, Update
-from telegram.ext import run_async
+from telegram import Bot, ChatAction, InlineKeyboardButton, InlineKeyboardMarkup, InputFile, InputMediaPhoto, \
+    Message, Update
+from telegram.ext import CallbackQueryHandler, run_async
 
 from xenian.bot import mongodb_database
 from xenian.bot.commands.animedatabase_utils.base_service import BaseService
@@ -17,8 +25,9 @@ from xenian.bot.commands.animedatabase_utils.danbooru_service import DanbooruSer
 from xenian.bot.commands.animedatabase_utils.message_queue import MessageQueue
 from xenian.bot.commands.animedatabase_utils.moebooru_service import MoebooruService
 from xenian.bot.commands.animedatabase_utils.post import Post, PostError
-from xenian.bot.settings import ANIME_SERVICES
-from xenian.bot.utils import CustomNamedTemporaryFile, TelegramProgressBar, download_file_from_url_and_upload
+from xenian.bot.settings import ANIME_SERVICES, BOORU, BOT_API
+from xenian.bot.utils import PHOTO_LIMITS, TelegramProgressBar, TimeoutCache, ZipBuilder, \
+    download_file_from_url_and_upload, fit_photo, input_file, photo_fits
 from . import BaseCommand
 import logging
 
@@ -34,12 +43,29 @@ class AnimeDatabases(BaseCommand):
 
     def __init__(self):
         self.files = mongodb_database.files
+        self.sent_files = mongodb_database.booru_sent_files
+        self.resize_executor = self.create_resize_executor()
+        self._resize_executor_lock = Lock()
+        self.search_executor = ThreadPoolExecutor(max_workers=BOORU['search_workers'])
+        self.prefetch_executor = ThreadPoolExecutor(max_workers=BOORU['prefetch_workers'])
+        self.next_pages = TimeoutCache(timeout=BOORU['next_page_timeout'], max_size=1000)
 
         self.services = {}
         self.init_services()
 
         super(AnimeDatabases, self).__init__()
 
+    @staticmethod
+    def create_resize_executor() -> ProcessPoolExecutor:
+        """Create the process pool images are downsized in
+
+        Returns:
+            :obj:`concurrent.futures.ProcessPoolExecutor`: The process pool
+        """
+        # Forking the multithreaded bot could copy locks held by other threads into the workers
+        return ProcessPoolExecutor(max_workers=BOORU['resize_processes'],
+                                   mp_context=multiprocessing.get_context('spawn'))
+
     def init_services(self):
         """Initialize services
         """
@@ -47,10 +73,13 @@ class AnimeDatabases(BaseCommand):
             name = service['name']
             service_information = deepcopy(service)
             del service_information['type']
+            timeout = service_information.pop('timeout', None)
             if service['type'] == 'danbooru':
                 self.services[name] = DanbooruService(**service_information)
             if service['type'] == 'moebooru':
                 self.services[name] = MoebooruService(**service_information)
+            self.services[name].search_timeout = timeout or BOORU['search_timeout']
+            self.services[name].set_request_timeout(self.services[name].search_timeout)
 
             self.commands.append({
                 'title': name.capitalize(),
@@ -61,6 +90,21 @@ class AnimeDatabases(BaseCommand):
                 'args': ['tag1', 'tag2...', 'page=PAGE_NUM', 'limit=LIMIT', 'group=SIZE']
             })
 
+        self.commands.append({
+            'title': 'Booru',
+            'description': 'Search on all services at once',
+            'command': self.booru,
+            'options': {'pass_args': True},
+            'args': ['tag1', 'tag2...', 'page=PAGE_NUM', 'limit=LIMIT', 'group=SIZE']
+        })
+        self.commands.append({
+            'description': 'Send the next page of a search',
+            'command': self.next_page,
+            'handler': CallbackQueryHandler,
+            'options': {'pattern': '^booru_next'},
+            'hidden': True
+        })
+
     def search_wrapper(self, service_name: str) -> Callable:
         """Wrapper to set the service for the search command
 
@@ -181,7 +225,32 @@ class AnimeDatabases(BaseCommand):
             args (:obj:`list`, optional): List of search terms and options
         """
         message = update.message
-        text = ' '.join(args)
+        terms, query, group_size, zip_it = self.parse_search(message, args)
+
+        actual_tags = self.actual_tags(service, terms)
+        logger.info(f'terms={actual_tags}')
+
+        if service.tag_limit and len(actual_tags) > service.tag_limit:
+            message.reply_text(f'Only {service.tag_limit} tags can be used.', reply_to_message_id=message.message_id)
+            return
+
+        if service.censored_tags:
+            message.reply_text('Some tags may be censored', reply_to_message_id=message.message_id)
+
+        self.search_and_send(bot=bot, update=update, services=[service], query=query, group_size=group_size,
+                             zip_it=zip_it)
+
+    def parse_search(self, message: Message, args: list = None) -> tuple:
+        """Parse the search terms and options of a search command
+
+        Args:
+            message (:obj:`telegram.message.Message`): Message of the command, informed if the group size is too large
+            args (:obj:`list`, optional): List of search terms and options
+
+        Returns:
+            :obj:`tuple`: The search terms, the query for post_list, the group size and if the posts are zipped
+        """
+        text = ' '.join(args or [])
 
         text, page = self.extract_option_from_string('page', text, int)
         text, zip_it = self.extract_option_from_string('zip', text, bool)
@@ -208,149 +277,273 @@ class AnimeDatabases(BaseCommand):
         finally:
             terms = set(terms) - set(numbers)
 
-        actual_tags = terms
-        if not service.count_qualifiers_as_tag:
-            actual_tags = [term for term in terms if ':' not in term]  # Qualifiers like "order:score" are not tags
-
         logger.info(f'page={page} limit={limit} group_size={group_size} zip_it={zip_it}')
-        logger.info(f'terms={actual_tags}')
-
-        if service.tag_limit and len(actual_tags) > service.tag_limit:
-            message.reply_text(f'Only {service.tag_limit} tags can be used.', reply_to_message_id=message.message_id)
-            return
-
-        if service.censored_tags:
-            message.reply_text('Some tags may be censored', reply_to_message_id=message.message_id)
 
         query = {
             'page': page or 0,
             'limit': limit if limit and limit <= 100 else 10,
             'tags': ' '.join(terms),
         }
+        return terms, query, group_size, zip_it
 
-        method_name = f'{service.type}_real_search'
-        method = getattr(self, method_name, None)
+    def actual_tags(self, service: BaseService, terms: Iterable[str]) -> list:
+        """Get the terms which count as tags for the tag limit of a service
 
-        if not method:
-            raise NotImplementedError(f'Search function ({method_name}) for service {service.name} does not exist.')
+        Args:
+            service (:obj:`BaseService`): The service
+            terms (:obj:`Iterable`): The search terms
 
-        method(bot=bot, update=update, service=service, query=query, group_size=group_size, zip_it=zip_it)
+        Returns:
+            :obj:`list`: The terms counting as tags
+        """
+        if service.count_qualifiers_as_tag:
+            return list(terms)
+        return [term for term in terms if ':' not in term]  # Qualifiers like "order:score" are not tags
 
     @run_async
-    @MessageQueue.message_queue_exc_handler('queue')
-    def send_group(self, bot: Bot, update: Update, group: Iterable[InputMediaPhoto], queue: MessageQueue):
-        for item in group:
-            if os.path.isfile(item.media):
-                with open(item.media, 'rb') as file_:
-                    item.media = InputFile(file_, attach=True)
+    def booru(self, bot: Bot, update: Update, args: list = None):
+        """Search on all services at once
 
+        Services which allow fewer tags than given are left out, identical images found on multiple services are only
+        sent once.
+
+        Args:
+            bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+            update (:obj:`telegram.update.Update`): Telegram Api Update Object
+            args (:obj:`list`, optional): List of search terms and options
+        """
         message = update.message
-        bot.send_media_group(
-            chat_id=message.chat_id,
-            media=group,
-            reply_to_message_id=message.message_id,
-            disable_notification=True
-        )
-        for image in group:
-            queue.report()
+        terms, query, group_size, zip_it = self.parse_search(message, args)
 
-    @run_async
-    @MessageQueue.message_queue_exc_handler('queue')
-    def send_image(self, update: Update, image: InputMediaPhoto, queue: MessageQueue):
-        file = None
+        services = []
+        for service in self.services.values():
+            if service.tag_limit and len(self.actual_tags(service, terms)) > service.tag_limit:
+                message.reply_text(f'{service.name} was left out, only {service.tag_limit} tags can be used there.',
+                                   reply_to_message_id=message.message_id)
+                continue
+            services.append(service)
+
+        if not services:
+            return
+
+        self.search_and_send(bot=bot, update=update, services=services, query=query, group_size=group_size,
+                             zip_it=zip_it)
+
+    def search_and_send(self, bot: Bot, update: Update, services: Iterable[BaseService], query: dict,
+                        group_size: int = None, zip_it: bool = False):
+        """Search on the given services, send the found posts and offer the next page
+
+        Args:
+            bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+            update (:obj:`telegram.update.Update`): Telegram Api Update Object
+            services (:obj:`Iterable`): The services to search on
+            query (:obj:`dict`): Query for post_list
+            group_size (:obj:`int`, optional): If the found items are grouped to media groups of this size
+            zip_it (:obj:`bool`, optional): If the found items are sent as zip
+        """
         message = update.message
-        if os.path.isfile(image.media):
-            file = open(image.media, mode='rb')
+        services = list(services)
 
-        sent_media = None
-        if image.media.endswith(('.png', '.jpg')):
-            sent_media = message.reply_photo(
-                photo=file or image.media,
-                caption=image.caption,
-                disable_notification=True,
-                reply_to_message_id=message.message_id,
-            )
+        bot.send_chat_action(chat_id=message.chat_id, action=ChatAction.TYPING)
+        entries, failed = self.federated_post_list(services, query)
 
-        if file:
-            file.seek(0)
+        if failed:
+            message.reply_text(f'No answer from {", ".join(failed)}', reply_to_message_id=message.message_id)
 
-        message.chat.send_document(
-            document=file or image.media,
-            disable_notification=True,
-            caption=image.caption,
-            reply_to_message_id=sent_media.message_id if sent_media else None,
-        )
-        queue.report()
+        if not entries:
+            message.reply_text('Nothing found on page {page}'.format(**query))
+            return
 
-    @run_async
-    def send_zip(self, update: Update, posts=Iterable[Post]):
-        with CustomNamedTemporaryFile(prefix='xenian-', suffix='.zip') as zip_file:
-            zip = zipfile.ZipFile(zip_file.name, mode='w')
-
-            text_file_content = ''
-            for post in posts:
-                if os.path.isfile(post.media):
-                    filename = os.path.basename(str(post.post['id']) + os.path.splitext(post.media)[1])
-                    json_filename = filename + '.json'
-                    zip.write(post.media, filename)
-                    text_file_content += f'{filename} ({filename}.json) -> {post.post_url}\n'
-
-                    with CustomNamedTemporaryFile(mode='w') as json_file:
-                        json.dump(post.post, json_file, indent=4, sort_keys=True)
-                        json_file.close()
-                        zip.write(json_file.name, json_filename)
-
-            with CustomNamedTemporaryFile(mode='w') as text_file:
-                text_file.write(text_file_content)
-                text_file.close()
-                zip.write(text_file.name, 'Links.txt')
-
-            zip.close()
-
-            update.message.chat.send_document(
-                document=zip_file,
-                reply_to_message_id=update.message.message_id,
-            )
+        self.send_posts(bot=bot, update=update, entries=entries, group_size=group_size, zip_it=zip_it)
+        if len(entries) >= query['limit']:
+            self.offer_next_page(update=update, services=services, query=query, group_size=group_size, zip_it=zip_it)
 
-    # Danbooru API commands
+    def offer_next_page(self, update: Update, services: Iterable[BaseService], query: dict, group_size: int = None,
+                        zip_it: bool = False):
+        """Send a button for the next page of a search and prefetch the page in the background meanwhile
 
-    def danbooru_get_image(self, post: dict, service: DanbooruService) -> Post:
-        image_url = post.get('large_file_url', None)
-        post_url = '{domain}/posts/{post_id}'.format(domain=service.url, post_id=post['id'])
+        Only the last search of each user can be continued, for BOORU['next_page_timeout'] sec.
 
-        image_url = self.get_image(post['id'], image_url) or image_url
+        Args:
+            update (:obj:`telegram.update.Update`): Telegram Api Update Object
+            services (:obj:`Iterable`): The services searched on
+            query (:obj:`dict`): Query for post_list of the current page
+            group_size (:obj:`int`, optional): If the found items are grouped to media groups of this size
+            zip_it (:obj:`bool`, optional): If the found items are sent as zip
+        """
+        services = list(services)
+        # Page 0 and 1 are both the first page
+        page = max(query['page'], 1)
+        next_query = dict(query, page=page + 1)
+
+        self.next_pages.set(update.effective_user.id, {
+            'services': [service.name for service in services],
+            'query': next_query,
+            'group_size': group_size,
+            'zip_it': zip_it,
+            'prefetch': self.prefetch_executor.submit(self.prefetch_page, services, next_query, zip_it),
+        })
+
+        message = update.effective_message
+        message.reply_text(
+            f'Page {page}',
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton('Next page', callback_data=f'booru_next {next_query["page"]}'),
+            ]]),
+            reply_to_message_id=message.message_id,
+            disable_notification=True,
+        )
 
-        # if not image_url and service.session:
-        #     response = service.session.get(post_url)
-        #     img_tag = response.html.find('#image-container > img')
+    def prefetch_page(self, services: Iterable[BaseService], query: dict, zip_it: bool = False) -> tuple:
+        """Get the posts of a page and the first BOORU['prefetch_images'] images
 
-        #     if img_tag:
-        #         img_tag = img_tag[0]
-        #         image_url = self.get_image(post['id'], img_tag.attrs['src'])
+        Only images which are stored locally before sending are downloaded. Posts whose image Telegram fetches by its
+        url, like Moebooru posts not sent as zip, only have their post list prefetched.
 
-        if not image_url:
-            raise PostError(code=PostError.IMAGE_NOT_FOUND, post=Post(post=post, post_url=post_url))
+        Args:
+            services (:obj:`Iterable`): The services to search on
+            query (:obj:`dict`): Query for post_list
+            zip_it (:obj:`bool`, optional): If the images have to be available locally for a zip
+
+        Returns:
+            :obj:`tuple`: The entries and failed services as returned by :meth:`federated_post_list` and a dict of the
+                prepared :obj:`Post` or :obj:`PostError` by the index of the entry
+        """
+        entries, failed = self.federated_post_list(services, query)
 
-        return Post(post, media=image_url, caption=f'@XenianBot - {post_url}', post_url=post_url)
+        prepared = {}
+        for index, (service, post) in enumerate(entries[:BOORU['prefetch_images']]):
+            try:
+                prepared[index] = self.get_post(service=service, post=post, download=zip_it)
+            except PostError as error:
+                prepared[index] = error
+        return entries, failed, prepared
 
-    def danbooru_real_search(self, bot: Bot, update: Update, service: DanbooruService, query: dict,
-                             group_size: bool = False, zip_it: bool = False):
-        """Send Danbooru API Service queried images to user
+    @run_async
+    def next_page(self, bot: Bot, update: Update):
+        """Send the next page of the last search of a user
 
         Args:
             bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
             update (:obj:`telegram.update.Update`): Telegram Api Update Object
-            query (:obj:`dict`): Query with keywords for post_list see:
-                https://pybooru.readthedocs.io/en/stable/api_danbooru.html#pybooru.api_danbooru.DanbooruApi_Mixin.post_list
-            group_size (:obj:`bool`): If the found items shall be grouped to a media group
         """
-        message = update.message
-        posts = service.client.post_list(**query)
+        callback_query = update.callback_query
+        page = int(callback_query.data.split(' ')[1])
+        # Popped at once, so tapping the button twice does not send the page twice
+        search = self.next_pages.pop(update.effective_user.id)
+        if search and search['query']['page'] != page:
+            # Button of an older page, the last search stays available
+            self.next_pages.set(update.effective_user.id, search)
+            search = None
+        if not search:
+            callback_query.answer('This search expired, please search again.')
+            return
+        callback_query.answer()
 
-        if not posts:
-            message.reply_text('Nothing found on page {page}'.format(**query))
+        message = update.effective_message
+        message.edit_reply_markup(reply_markup=None)
+
+        try:
+            entries, failed, prepared = search['prefetch'].result()
+        except Exception as error:
+            logger.warning(f'Prefetching page {page} failed: {error}')
+            message.reply_text(f'Page {page} could not be loaded, please try again.',
+                               reply_to_message_id=message.message_id)
+            return
+
+        if failed:
+            message.reply_text(f'No answer from {", ".join(failed)}', reply_to_message_id=message.message_id)
+
+        if not entries:
+            message.reply_text(f'Nothing found on page {page}', reply_to_message_id=message.message_id)
             return
 
+        group_size, zip_it = search['group_size'], search['zip_it']
+        self.send_posts(bot=bot, update=update, entries=entries, group_size=group_size, zip_it=zip_it,
+                        prepared=prepared)
+        if len(entries) >= search['query']['limit']:
+            services = [self.services[name] for name in search['services']]
+            self.offer_next_page(update=update, services=services, query=search['query'], group_size=group_size,
+                                 zip_it=zip_it)
+
+    def federated_post_list(self, services: Iterable[BaseService], query: dict) -> tuple:
+        """Query multiple services at once and merge their posts
+
+        The services are queried in the threads of the search executor shared by all searches. Each service has its
+        search_timeout to answer, its client gives up after the same time, so a hanging service does not keep a
+        thread busy. The posts are merged alternately by their rank on each service, posts with an md5 already found
+        on a service configured earlier are left out.
+
+        Args:
+            services (:obj:`Iterable`): The services to query
+            query (:obj:`dict`): Query for post_list
+
+        Returns:
+            :obj:`tuple`: A list of (service, post) tuples and a list of names of services which failed or timed out
+        """
+        services = list(services)
+        start = time.monotonic()
+        futures = [self.search_executor.submit(service.client.post_list, **query) for service in services]
+
+        results = []
+        failed = []
+        for service, future in zip(services, futures):
+            try:
+                posts = future.result(timeout=max(0, start + service.search_timeout - time.monotonic()))
+                results.append([(service, post) for post in posts or []])
+            except TimeoutError:
+                failed.append(service.name)
+            except Exception as error:
+                logger.warning(f'Search on {service.name} failed: {error}')
+                failed.append(service.name)
+
+        entries = []
+        seen = set()
+        for rank in range(max(map(len, results), default=0)):
+            for service_posts in results:
+                if rank >= len(service_posts):
+                    continue
+                service, post = service_posts[rank]
+                md5 = post.get('md5', None)
+                if md5 and md5 in seen:
+                    continue
+                seen.add(md5)
+                entries.append((service, post))
+        return entries, failed
+
+    def get_post(self, service: BaseService, post: dict, download: bool = False) -> Post:
+        """Get the post of any service
+
+        Args:
+            service (:obj:`BaseService`): Service the post is from
+            post (:obj:`dict`): The post as returned by the api
+            download (:obj:`bool`, optional): If the image has to be available locally
+
+        Returns:
+            :obj:`xenian.bot.commands.animedatabase_utils.post.Post`: The post
+
+        Raises:
+            PostError: If the image of the post could not be found
+        """
+        if isinstance(service, MoebooruService):
+            return self.moebooru_get_image(post=post, service=service, download=download)
+        return self.danbooru_get_image(post=post, service=service)
+
+    def send_posts(self, bot: Bot, update: Update, entries: list, group_size: int = None, zip_it: bool = False,
+                   prepared: dict = None):
+        """Send posts of any services to the user
+
+        Args:
+            bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+            update (:obj:`telegram.update.Update`): Telegram Api Update Object
+            entries (:obj:`list`): List of (service, post) tuples
+            group_size (:obj:`int`, optional): If the found items shall be grouped to media groups of this size
+            zip_it (:obj:`bool`, optional): If the found items shall be sent as zip
+            prepared (:obj:`dict`, optional): Already prepared :obj:`Post` or :obj:`PostError` by the index of the
+                entry, see :meth:`prefetch_page`
+        """
+        prepared = prepared or {}
+        message = update.effective_message
         progress_bar = TelegramProgressBar(
             bot=bot,
             chat_id=message.chat_id,
@@ -358,13 +551,15 @@ class AnimeDatabases(BaseCommand):
             se_message='This could take some time.'
         )
 
-        message_queue = MessageQueue(total=len(posts), message=message, group_size=group_size)
+        message_queue = MessageQueue(total=len(entries), message=message, group_size=group_size)
 
         parsed_posts = []
         group = []
-        for index, post_dict in progress_bar.enumerate(posts):
+        for index, (service, post_dict) in progress_bar.enumerate(entries):
             try:
-                post = self.danbooru_get_image(post=post_dict, service=service)
+                post = prepared.get(index, None) or self.get_post(service=service, post=post_dict, download=zip_it)
+                if isinstance(post, PostError):
+                    raise post
                 parsed_posts.append(post)
             except PostError as error:
                 message_queue.report(error)
@@ -377,78 +572,247 @@ class AnimeDatabases(BaseCommand):
                 if post.is_video():
                     message_queue.report(PostError(code=PostError.WRONG_FILE_TYPE, post=post))
                     continue
-                if index and index % group_size == 0:
+                group.append(post)
+                if len(group) == group_size:
                     self.send_group(group=group, bot=bot, update=update, queue=message_queue)
                     group = []
-                group.append(post.telegram)
                 continue
 
             bot.send_chat_action(chat_id=message.chat_id, action=ChatAction.UPLOAD_PHOTO)
-            self.send_image(update=update, image=post.telegram, queue=message_queue)
+            self.send_image(update=update, post=post, queue=message_queue)
 
         if zip_it:
             self.send_zip(update=update, posts=parsed_posts)
-            return
-
-        if group:
+        elif group:
             self.send_group(group=group, bot=bot, update=update, queue=message_queue)
 
-    # Moebooru API commands
+    @run_async
+    @MessageQueue.message_queue_exc_handler('queue')
+    def send_group(self, bot: Bot, update: Update, group: Iterable[Post], queue: MessageQueue):
+        with ExitStack() as stack:
+            media_group = []
+            for post in group:
+                photo = stack.enter_context(self.fitting_photo(post))
+                if not photo:
+                    # Can not be sent as photo at all, so it is sent on its own as document
+                    self.send_image(update=update, post=post, queue=queue)
+                    continue
 
-    def moebooru_get_image(self, post: dict, service: MoebooruService, download: bool = False) -> Post:
-        post_url = '{domain}/posts/{post_id}'.format(domain=service.url, post_id=post['id'])
-        image_path = post['file_url']
+                if os.path.isfile(photo):
+                    with input_file(photo) as file_:
+                        photo = file_ if isinstance(file_, str) else InputFile(file_, attach=True)
+                media_group.append(InputMediaPhoto(photo, post.caption))
 
-        if download:
-            image_path = self.get_image(post['id'], post['file_url'])
+            if not media_group:
+                return
 
-        return Post(post=post, media=image_path, caption=f'@XenianBot - {post_url}', post_url=post_url)
+            message = update.effective_message
+            # Wait for the upload while the downsized photos still exist and so that errors reach the queue
+            bot.send_media_group(
+                chat_id=message.chat_id,
+                media=media_group,
+                reply_to_message_id=message.message_id,
+                disable_notification=True
+            ).result()
+        for image in media_group:
+            queue.report()
 
-    def moebooru_real_search(self, bot: Bot, update: Update, service: MoebooruService, query: dict,
-                             group_size: bool = False, zip_it: bool = False):
-        message = update.message
-        posts = service.client.post_list(**query)
+    @run_async
+    @MessageQueue.message_queue_exc_handler('queue')
+    def send_image(self, update: Update, post: Post, queue: MessageQueue):
+        """Send a single image as photo and / or document depending on BOORU['send_mode']
 
-        if not posts:
-            message.reply_text('Nothing found on page {page}'.format(**query))
-            return
+        Each file is uploaded at most once per kind, afterwards it is sent again by the file_id Telegram returned.
 
-        progress_bar = TelegramProgressBar(
-            bot=bot,
-            chat_id=message.chat_id,
-            pre_message=('Gathering' if group_size or zip_it else 'Sending') + ' files\n{current} / {total}',
-            se_message='This could take some time.'
-        )
+        Args:
+            update (:obj:`telegram.update.Update`): Telegram Api Update Object
+            post (:obj:`xenian.bot.commands.animedatabase_utils.post.Post`): The post with the url or path of the image
+            queue (:obj:`MessageQueue`): Queue the sent image is reported to
+        """
+        message = update.effective_message
+        media = post.media
+        sent_files = self.sent_files.find_one({'media': media}) or {}
+        file_ids = {}
 
-        message_queue = MessageQueue(total=len(posts), message=message, group_size=group_size)
+        sent_media = None
+        if BOORU['send_mode'] != 'document' and media.endswith(('.png', '.jpg')):
+            with ExitStack() as stack:
+                photo = sent_files.get('photo', None)
+                if not photo:
+                    photo = stack.enter_context(self.fitting_photo(post))
+                    photo = photo and stack.enter_context(self.telegram_media(photo))
+
+                if photo:
+                    sent_media = message.reply_photo(
+                        photo=photo,
+                        caption=post.caption,
+                        disable_notification=True,
+                        reply_to_message_id=message.message_id,
+                    ).result()
+                    file_ids['photo'] = sent_media.photo[-1].file_id
+
+        if not sent_media or BOORU['send_mode'] != 'photo':
+            with self.telegram_media(media, sent_files.get('document', None)) as document:
+                sent_document = message.chat.send_document(
+                    document=document,
+                    disable_notification=True,
+                    caption=post.caption,
+                    reply_to_message_id=sent_media.message_id if sent_media else None,
+                ).result()
+            file_ids['document'] = sent_document.document.file_id
+
+        if any(sent_files.get(kind, None) != file_id for kind, file_id in file_ids.items()):
+            self.sent_files.update_one({'media': media}, {'$set': file_ids}, upsert=True)
+        queue.report()
 
-        group = []
-        parsed_posts = []
-        for index, post_dict in progress_bar.enumerate(posts):
-            post = self.moebooru_get_image(post=post_dict, service=service, download=zip_it)
-            parsed_posts.append(post)
+    @contextmanager
+    def fitting_photo(self, post: Post):
+        """Get the image of a post fitting the limits of Telegram photos
 
-            if zip_it:
-                continue
+        Images which are too large are downloaded and downsized in the resize process pool, the original stays the
+        media of the post for documents and zips.
 
-            if group_size:
-                if post.is_video():
-                    message_queue.report(PostError(code=PostError.WRONG_FILE_TYPE, post=post))
-                    continue
-                if index and index % group_size == 0:
-                    self.send_group(group=group, bot=bot, update=update, queue=message_queue)
-                    group = []
-                group.append(post.telegram)
-                continue
-            else:
-                self.send_image(update=update, image=post.telegram, queue=message_queue)
+        Args:
+            post (:obj:`xenian.bot.commands.animedatabase_utils.post.Post`): The post
 
-        if zip_it:
-            self.send_zip(update=update, posts=parsed_posts)
+        Returns:
+            :obj:`str` or :obj:`None`: Url or path of the image or a downsized copy, :obj:`None` if the image can not
+                be sent as photo
+        """
+        media = post.media
+        width, height = post.dimensions or (None, None)
+        file_size = post.file_size
+        is_file = os.path.isfile(media)
+        if is_file:
+            file_size = os.path.getsize(media)
+            try:
+                with Image.open(media) as image:
+                    width, height = image.size
+            except OSError:
+                yield None
+                return
+
+        if width and height and max(width, height) > min(width, height) * PHOTO_LIMITS['max_ratio']:
+            yield None
             return
 
-        if group:
-            self.send_group(group=group, bot=bot, update=update, queue=message_queue)
+        if photo_fits(width, height, file_size, by_url=not is_file):
+            yield media
+            return
+
+        if is_file:
+            with open(media, 'rb') as image_file:
+                data = image_file.read()
+        try:
+            if not is_file:
+                response = requests.get(media, timeout=30)
+                response.raise_for_status()
+                data = response.content
+            resize_executor = self.resize_executor
+            photo = resize_executor.submit(fit_photo, data, max_edge=BOORU['photo_max_edge'],
+                                           quality=BOORU['photo_quality']).result()
+        except BrokenProcessPool:
+            # A worker died, for example killed on a huge image. The pool is unusable from now on, so it is replaced
+            # and the post is sent as document instead.
+            with self._resize_executor_lock:
+                if self.resize_executor is resize_executor:
+                    self.resize_executor = self.create_resize_executor()
+            resize_executor.shutdown(wait=False)
+            yield None
+            return
+        except (OSError, ValueError, requests.RequestException):
+            yield None
+            return
+
+        with NamedTemporaryFile(suffix='.jpg') as photo_file:
+            photo_file.write(photo)
+            photo_file.flush()
+            yield photo_file.name
+
+    @contextmanager
+    def telegram_media(self, media: str, file_id: str = None):
+        """Get a file for sending to Telegram
+
+        Args:
+            media (:obj:`str`): Url or path of the file
+            file_id (:obj:`str`, optional): file_id of the file if it was sent before
+
+        Returns:
+            :obj:`str` or :obj:`io.BufferedReader`: The file_id, the url or the file to upload
+        """
+        if file_id:
+            yield file_id
+        elif os.path.isfile(media):
+            with input_file(media) as file:
+                yield file
+        else:
+            yield media
+
+    @run_async
+    def send_zip(self, update: Update, posts=Iterable[Post]):
+        with TemporaryDirectory() as temp_dir:
+            message = update.effective_message
+            archive_name = 'xenian-' + str(message.message_id)
+            with ZipBuilder(temp_dir, archive_name, max_bytes=BOT_API['upload_limit']) as archive:
+                text_file_content = ''
+                for post in posts:
+                    if os.path.isfile(post.media):
+                        filename = os.path.basename(str(post.post['id']) + os.path.splitext(post.media)[1])
+                        json_filename = filename + '.json'
+                        archive.add_file(post.media, filename)
+                        archive.add_data(json.dumps(post.post, indent=4, sort_keys=True), json_filename)
+                        text_file_content += f'{filename} ({filename}.json) -> {post.post_url}\n'
+
+                archive.add_data(text_file_content, 'Links.txt')
+
+            for volume in archive.volumes:
+                # Wait for the upload, a local Bot API server reads the volume only when the message is sent
+                with input_file(volume) as zip_file:
+                    message.chat.send_document(
+                        document=zip_file,
+                        reply_to_message_id=message.message_id,
+                    ).result()
+
+    # Danbooru API commands
+
+    def danbooru_get_image(self, post: dict, service: DanbooruService) -> Post:
+        image_url = post.get('large_file_url', None)
+        post_url = '{domain}/posts/{post_id}'.format(domain=service.url, post_id=post['id'])
+
+        image_url = self.get_image(post['id'], image_url) or image_url
+
+        # if not image_url and service.session:
+        #     response = service.session.get(post_url)
+        #     img_tag = response.html.find('#image-container > img')
+
+        #     if img_tag:
+        #         img_tag = img_tag[0]
+        #         image_url = self.get_image(post['id'], img_tag.attrs['src'])
+
+        if not image_url:
+            raise PostError(code=PostError.IMAGE_NOT_FOUND, post=Post(post=post, post_url=post_url))
+
+        dimensions = file_size = None
+        if not post.get('has_large', False):
+            # Otherwise the large file is a downsized sample, the size of the original does not apply to it
+            dimensions = (post.get('image_width', None), post.get('image_height', None))
+            file_size = post.get('file_size', None)
+
+        return Post(post, media=image_url, caption=f'@XenianBot - {post_url}', post_url=post_url,
+                    dimensions=dimensions, file_size=file_size)
+
+    # Moebooru API commands
+
+    def moebooru_get_image(self, post: dict, service: MoebooruService, download: bool = False) -> Post:
+        post_url = '{domain}/posts/{post_id}'.format(domain=service.url, post_id=post['id'])
+        image_path = post['file_url']
+
+        if download:
+            image_path = self.get_image(post['id'], post['file_url'])
+
+        return Post(post=post, media=image_path, caption=f'@XenianBot - {post_url}', post_url=post_url,
+                    dimensions=(post.get('width', None), post.get('height', None)),
+                    file_size=post.get('file_size', None))
 
 
 animedatabases = AnimeDatabases()
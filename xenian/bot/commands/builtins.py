@@ -2,8 +2,9 @@ from telegram import Bot, Update
 from telegram.ext import CommandHandler, MessageHandler
 from telegram.parsemode import ParseMode
 
+from xenian.bot.commands.filters import bot_admin
 from xenian.bot.settings import ADMINS, SUPPORTER
-from xenian.bot.utils import data, get_user_link, render_template
+from xenian.bot.utils import artifact_cache, data, get_user_link, media_cache, render_template
 from .base import BaseCommand
 
 __all__ = ['builtins']
@@ -33,6 +34,18 @@ class Builtins(BaseCommand):
                 'description': 'If you have found an error please use this command.',
                 'args': ['text']
             },
+            {
+                'command': self.cache_stats,
+                'description': 'Show usage of the media and artifact caches',
+                'options': {'filters': bot_admin},
+                'hidden': True,
+            },
+            {
+                'command': self.message_stats,
+                'description': 'Show the outgoing message queue and send times per method',
+                'options': {'filters': bot_admin},
+                'hidden': True,
+            },
         ]
 
         super(Builtins, self).__init__()
@@ -217,5 +230,49 @@ class Builtins(BaseCommand):
 
         update.message.reply_text(f'You have been registered as {register_as.strip()}')
 
+    def cache_stats(self, bot: Bot, update: Update):
+        """Show usage of the media and artifact caches
+
+        Args:
+            bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+            update (:obj:`telegram.update.Update`): Telegram Api Update Object
+        """
+        lines = []
+        for name, cache in [('Media', media_cache), ('Artifacts', artifact_cache)]:
+            stats = cache.stats()
+            lines.append('*{name}*\n'
+                         '{files} files, {mb:.1f} / {max_mb:.1f} MB\n'
+                         '{hits} hits, {misses} misses, {hit_rate:.0%} hit rate'.format(
+                             name=name,
+                             mb=stats['bytes'] / 1024 ** 2,
+                             max_mb=stats['max_bytes'] / 1024 ** 2,
+                             **stats))
+
+        update.message.reply_text('\n\n'.join(lines), parse_mode=ParseMode.MARKDOWN)
+
+    def message_stats(self, bot: Bot, update: Update):
+        """Show the outgoing message queue and send times per method
+
+        Args:
+            bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+            update (:obj:`telegram.update.Update`): Telegram Api Update Object
+        """
+        scheduler = getattr(bot, 'message_scheduler', None)
+        if not scheduler:
+            update.message.reply_text('Messages are not scheduled.')
+            return
+
+        stats = scheduler.stats()
+        lines = ['*Queue*\n'
+                 '{queued} queued, {in_flight} sending, {paused_chats} paused chats, {retries} retries'.format(**stats)]
+        for method, metrics in sorted(stats['methods'].items()):
+            lines.append('*{method}*\n'
+                         '{count} sent, {errors} errors\n'
+                         'Latency {latency_avg:.2f} sec avg, {latency_max:.2f} sec max\n'
+                         'Queue delay {delay_avg:.2f} sec avg, {delay_max:.2f} sec max'.format(method=method,
+                                                                                               **metrics))
+
+        update.message.reply_text('\n\n'.join(lines), parse_mode=ParseMode.MARKDOWN)
+
 
 builtins = Builtins()
@@ -80,7 +80,7 @@ class Calculator(BaseCommand):
                     equation=equation,
                     result=result
                 )
-                update.message.reply_text(reply, parse_mode=ParseMode.MARKDOWN)
+                update.message.reply_text(reply, parse_mode=ParseMode.MARKDOWN).result()
             except BadRequest:
                 update.message.reply_text('Result was too long (max. 4096 characters) for Telegram.')
         except (SyntaxError, TypeError) as e:
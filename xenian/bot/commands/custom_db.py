@@ -348,11 +348,11 @@ class CustomDB(BaseCommand):
                 return
             try:
                 if item_type == 'text':
-                    reply_method(item['text'])
+                    reply_method(item['text']).result()
                 elif item_type == 'sticker':
-                    reply_method(item['file_id'])
+                    reply_method(item['file_id']).result()
                 elif item_type in ['document', 'photo', 'video', 'voice', 'audio']:
-                    reply_method(item['file_id'], caption=item['text'])
+                    reply_method(item['file_id'], caption=item['text']).result()
             except TelegramError:
                 message_obj.reply_text(f'Something went wrong for the item `{item["_id"]}`, please contact an admin '
                                        f'/error', parse_mode=ParseMode.MARKDOWN)
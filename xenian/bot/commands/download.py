@@ -1,28 +1,83 @@
+import json
+import multiprocessing
 import os
 import re
 import shutil
 
-from PIL import Image
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from io import BufferedWriter
-from tempfile import NamedTemporaryFile, TemporaryDirectory
-from urllib.parse import urldefrag
+from tempfile import TemporaryDirectory
+from threading import BoundedSemaphore, Lock
+from typing import Callable
+from urllib.parse import parse_qsl, urldefrag, urlencode, urlsplit, urlunsplit
 from uuid import uuid4
 
 import youtube_dlc
-from moviepy.video.io.VideoFileClip import VideoFileClip
-from telegram import Bot, ChatAction, Document, InlineKeyboardButton, InlineKeyboardMarkup, MessageEntity, ParseMode, \
-    Sticker, Update, Video
+from telegram import Bot, ChatAction, Document, InlineKeyboardButton, InlineKeyboardMarkup, Message, MessageEntity, \
+    ParseMode, Sticker, Update, Video
 from telegram.error import BadRequest, NetworkError, TimedOut
 from telegram.ext import CallbackQueryHandler, Filters, MessageHandler, run_async
+from pymongo import ASCENDING
 from youtube_dlc import DownloadError
 
-from xenian.bot.settings import UPLOADER
+from xenian.bot import mongodb_database
+from xenian.bot.settings import AUDIO, BOT_API, PLAYLIST, STICKER_PACK, UPLOADER, VIDEO_DOWNLOADER, ZIP_MODE
 from xenian.bot.uploaders import uploader
-from xenian.bot.utils import CustomNamedTemporaryFile, TelegramProgressBar, save_file
+from xenian.bot.utils import CustomNamedTemporaryFile, Job, TelegramProgressBar, TimeoutCache, ZipBuilder, \
+    gif_from_video, input_file, job_manager, sticker_to_image
 from . import BaseCommand
 from .filters.download_mode import download_mode_filter
 
-__all__ = ['download', 'video_downloader']
+__all__ = ['download', 'video_downloader', 'conversion_job', 'send_archive']
+
+
+def conversion_job(bot: Bot, user_id: int, chat_id: int, name: str, func: Callable[[Job], None],
+                   reply_to_message_id: int = None) -> Job:
+    """Run a download or conversion in the job queue and keep the user informed about it
+
+    The job runs in a worker thread of the job queue, so the calling handler does not wait while it is queued. The user
+    is told the position in the queue if the job has to wait and is notified if the job is cancelled.
+
+    Args:
+        bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+        user_id (:obj:`int`): Id of the user the job belongs to
+        chat_id (:obj:`int`): Id of the chat the messages are sent to
+        name (:obj:`str`): Human readable name of the job
+        func (:obj:`Callable`): The work, called with the running :obj:`xenian.bot.utils.jobs.Job`
+        reply_to_message_id (:obj:`int`, optional): Message the messages reply to
+
+    Returns:
+        :obj:`xenian.bot.utils.jobs.Job`: The queued job
+    """
+    def on_queued(position: int):
+        bot.send_message(chat_id=chat_id, text=f'{name} is queued at position {position}. Use /cancel to cancel it.',
+                         reply_to_message_id=reply_to_message_id)
+
+    def on_cancelled():
+        bot.send_message(chat_id=chat_id, text=f'{name} was cancelled or took too long.',
+                         reply_to_message_id=reply_to_message_id)
+
+    return job_manager.submit(user_id, name, func, on_queued=on_queued, on_cancelled=on_cancelled)
+
+
+def send_archive(message: Message, archive: ZipBuilder):
+    """Send all volumes of an archive as reply to a message
+
+    Args:
+        message (:obj:`telegram.message.Message`): Message the volumes reply to
+        archive (:obj:`xenian.bot.utils.archive.ZipBuilder`): The closed archive
+    """
+    if archive.skipped:
+        message.reply_text('Some files were too big and were left out: ' + ', '.join(archive.skipped),
+                           reply_to_message_id=message.message_id)
+
+    for volume in archive.volumes:
+        # Wait for the upload, a local Bot API server reads the volume only when the message is sent
+        with input_file(volume) as zip_file:
+            message.reply_document(zip_file, filename=os.path.basename(volume), timeout=50,
+                                   reply_to_message_id=message.message_id).result()
 
 
 class Download(BaseCommand):
@@ -59,6 +114,12 @@ class Download(BaseCommand):
                 'command': self.download_stickers,
                 'options': {'filters': Filters.sticker & download_mode_filter & ~ Filters.group}
             },
+            {
+                'title': 'Download Sticker Pack',
+                'description': 'Reply to a sticker to download its whole sticker pack as zip',
+                'command': self.sticker_pack,
+                'options': {'filters': ~ Filters.group}
+            },
             {
                 'title': 'Download Gifs',
                 'description': 'Turn on /download_mode and send videos and gifs',
@@ -69,6 +130,10 @@ class Download(BaseCommand):
             {
                 'description': 'Reply to media for download',
                 'command': self.download,
+            },
+            {
+                'description': 'Cancel your running and queued downloads and conversions',
+                'command': self.cancel,
             }
         ]
 
@@ -104,6 +169,20 @@ class Download(BaseCommand):
             self.download_zip(bot, update, update.message.from_user.id)
             update.message.reply_text('Download Mode off')
 
+    def cancel(self, bot: Bot, update: Update):
+        """Cancel all running and queued downloads and conversions of the user
+
+        Args:
+            bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+            update (:obj:`telegram.update.Update`): Telegram Api Update Object
+        """
+        cancelled = job_manager.cancel(update.message.from_user.id)
+        if cancelled:
+            update.message.reply_text(f'Cancelled {cancelled} download(s) / conversion(s).',
+                                      reply_to_message_id=update.message.message_id)
+        else:
+            update.message.reply_text('Nothing to cancel.', reply_to_message_id=update.message.message_id)
+
     def zip_clear(self, bot: Bot, update: Update):
         """Clear ZIP download queue
 
@@ -134,64 +213,53 @@ class Download(BaseCommand):
             update.message.reply_text('No files sent for download')
             return
 
-        with TemporaryDirectory() as temp_folder:
-            zip_content_path = os.path.join(temp_folder, 'zip_content')
-            os.mkdir(zip_content_path)
-
-            progress_bar = TelegramProgressBar(
-                bot=bot,
-                chat_id=update.message.chat_id,
-                full_amount=len(user_files),
-                pre_message='Downloading files\n{current} / {total}',
-                se_message='Downloading GIFs may take a while.'
-            )
-            progress_bar.start()
-
-            for index, file in enumerate(user_files):
-                temp_file = None
-                if isinstance(file, Sticker):
-                    temp_file = NamedTemporaryFile(delete=False, dir=zip_content_path, prefix='xenian-', suffix='.png')
-                    self.download_stickers_to_file(bot, file, temp_file)
-
-                elif isinstance(file, Document) or isinstance(file, Video):
-                    temp_file = NamedTemporaryFile(delete=False, dir=zip_content_path, prefix='xenian-', suffix='.gif')
-                    _, orig_path, compressed_path = self.download_video_to_file(bot, file, temp_file, temp_file.name)
-
-                if temp_file:
-                    temp_file.close()
-                progress_bar.update(new_amount=index + 1)
-
-            zip_path = os.path.join(temp_folder, os.path.basename(f'downloads_{user_id}'))
-            os.chmod(zip_content_path, 0o40755)
-            created_zip = shutil.make_archive(zip_path, format='zip', root_dir=zip_content_path, base_dir='.')
+        def zip_files(job: Job):
+            with TemporaryDirectory() as temp_folder, \
+                    ZipBuilder(temp_folder, f'downloads_{user_id}', max_bytes=BOT_API['upload_limit']) as archive:
+                progress_bar = TelegramProgressBar(
+                    bot=bot,
+                    chat_id=update.message.chat_id,
+                    full_amount=len(user_files),
+                    pre_message='Downloading files\n{current} / {total}',
+                    se_message='Downloading GIFs may take a while.'
+                )
+                progress_bar.start()
+
+                def add_file(index: int, file):
+                    name = f'xenian-{index + 1:03}-{file.file_unique_id}'
+                    if isinstance(file, Sticker):
+                        with sticker_to_image(bot, file) as (image_path, extension):
+                            archive.add_file(image_path, name + extension)
+
+                    elif isinstance(file, Document) or isinstance(file, Video):
+                        with gif_from_video(bot, file) as (gif_path, compressed_gif_path):
+                            archive.add_file(gif_path, name + '.gif')
+                            if compressed_gif_path:
+                                archive.add_file(compressed_gif_path, name + '-min.gif')
+
+                max_size = BOT_API['upload_limit'] * ZIP_MODE['max_volumes']
+                with ThreadPoolExecutor(max_workers=ZIP_MODE['workers']) as executor:
+                    futures = [executor.submit(job.wrap(add_file), index, file)
+                               for index, file in enumerate(user_files)]
+                    try:
+                        for done, future in enumerate(as_completed(futures), start=1):
+                            job.check()
+                            future.result()
+                            if archive.size > max_size:
+                                break
+                            progress_bar.update(new_amount=done)
+                    finally:
+                        for future in futures:
+                            future.cancel()
 
-            if os.path.getsize(created_zip) > 52428800:
-                message.reply_text('File is too big, sorry!', reply_to_message_id=message.message_id)
-            else:
-                with open(created_zip, mode='br') as zip_file:
-                    message.reply_document(zip_file, filename=os.path.basename(created_zip), timeout=50,
-                                           reply_to_message_id=message.message_id)
+                if archive.size > max_size:
+                    message.reply_text('Files are too big, sorry!', reply_to_message_id=message.message_id)
+                    return
 
-    def download_stickers_to_file(self, bot: Bot, sticker: Sticker, file_object: BufferedWriter):
-        """Download Sticker as images to file_object
-
-        Args:
-            bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
-            sticker (:obj:`telegram.sticker.Sticker`): A Sticker object
-            file_object (:obj:`io.BufferedWriter`): File like object
-        """
-        sticker = bot.get_file(sticker.file_id)
-        sticker.download(out=file_object)
-
-        if getattr(file_object, 'save', None):
-            file_object.save()
-        else:
-            save_file(file_object)
+                archive.close()
+                send_archive(message, archive)
 
-        image = Image.open(file_object.name)
-        image.save(file_object, format='png')
-
-        return file_object
+        conversion_job(bot, user_id, message.chat_id, 'ZIP download', zip_files, message.message_id)
 
     @run_async
     def download_stickers(self, bot: Bot, update: Update):
@@ -208,10 +276,67 @@ class Download(BaseCommand):
             self.add_to_zip(update, user_id, orig_sticker)
             return
 
-        with CustomNamedTemporaryFile(suffix='.png', prefix='xenian-') as image:
-            self.download_stickers_to_file(bot, orig_sticker, image)
-            image.seek(0)
-            bot.send_photo(update.message.chat_id, photo=image)
+        with sticker_to_image(bot, orig_sticker) as (image_path, extension), input_file(image_path) as image:
+            if extension == '.png':
+                bot.send_photo(update.message.chat_id, photo=image).result()
+            else:
+                bot.send_document(update.message.chat_id, document=image,
+                                  filename=f'xenian-{orig_sticker.file_unique_id}{extension}').result()
+
+    @run_async
+    def sticker_pack(self, bot: Bot, update: Update):
+        """Download all stickers of a sticker pack as zip
+
+        Stickers are downloaded concurrently, static and animated ones are converted in a process pool and video
+        stickers by ffmpeg, which is killed on /cancel. Each sticker is added to the zip as soon as it is ready.
+
+        Args:
+            bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+            update (:obj:`telegram.update.Update`): Telegram Api Update Object
+        """
+        message = update.message
+        sticker = message.sticker or (message.reply_to_message.sticker if message.reply_to_message else None)
+        if not sticker or not sticker.set_name:
+            message.reply_text('You have to reply to a sticker of a sticker pack.',
+                               reply_to_message_id=message.message_id)
+            return
+
+        sticker_set = bot.get_sticker_set(sticker.set_name)
+
+        def download_pack(job: Job):
+            with TemporaryDirectory() as temp_folder:
+                progress_bar = TelegramProgressBar(
+                    bot=bot,
+                    chat_id=message.chat_id,
+                    full_amount=len(sticker_set.stickers),
+                    pre_message=f'Downloading {sticker_set.title}\n{{current}} / {{total}}',
+                )
+                progress_bar.start()
+
+                with ZipBuilder(temp_folder, sticker_set.name, max_bytes=BOT_API['upload_limit']) as archive, \
+                        ThreadPoolExecutor(max_workers=STICKER_PACK['download_workers']) as downloader, \
+                        ProcessPoolExecutor(max_workers=STICKER_PACK['conversion_processes'],
+                                            mp_context=multiprocessing.get_context('spawn')) as converter:
+
+                    def add_sticker(index: int, pack_sticker: Sticker):
+                        with sticker_to_image(bot, pack_sticker, converter) as (image_path, extension):
+                            archive.add_file(image_path, f'{index + 1:03}{extension}')
+
+                    futures = [downloader.submit(job.wrap(add_sticker), index, pack_sticker)
+                               for index, pack_sticker in enumerate(sticker_set.stickers)]
+                    try:
+                        for done, future in enumerate(as_completed(futures), start=1):
+                            job.check()
+                            future.result()
+                            progress_bar.update(new_amount=done)
+                    finally:
+                        for future in futures:
+                            future.cancel()
+
+                send_archive(message, archive)
+
+        conversion_job(bot, message.from_user.id, message.chat_id, 'Sticker pack download', download_pack,
+                       message.message_id)
 
     def download_video_to_file(self, bot: Bot, document: Document, file_object: BufferedWriter, file_object_path: str):
         """Download Sticker as images to file_object
@@ -222,22 +347,15 @@ class Download(BaseCommand):
             file_object (:obj:`io.BufferedWriter`): Actual existing file object
             file_object_path (:obj:`str`): The path to the file given in file_object
         """
-        video = bot.getFile(document.file_id)
-
-        with CustomNamedTemporaryFile() as video_file:
-            video.download(out=video_file)
-            video_file.close()
-            video_clip = VideoFileClip(video_file.name, audio=False)
-
-            video_clip.write_gif(file_object_path)
-            video_clip.close()
+        with gif_from_video(bot, document) as (gif_path, cached_compressed_gif_path):
+            shutil.copyfile(gif_path, file_object_path)
 
             dirname = os.path.dirname(file_object_path)
             file_name = os.path.splitext(file_object_path)[0]
-            compressed_gif_path = os.path.join(dirname, file_name + '-min.gif')
-
-            os.system('gifsicle -O3 --lossy=50 -o {dst} {src}'.format(dst=compressed_gif_path, src=file_object_path))
-            compressed_gif_path = compressed_gif_path if os.path.isfile(compressed_gif_path) else ''
+            compressed_gif_path = ''
+            if cached_compressed_gif_path:
+                compressed_gif_path = os.path.join(dirname, file_name + '-min.gif')
+                shutil.copyfile(cached_compressed_gif_path, compressed_gif_path)
             return file_object, file_object_path, compressed_gif_path
 
     @run_async
@@ -255,54 +373,53 @@ class Download(BaseCommand):
                     update.message.reply_to_message.video)
 
         user_id = update.message.from_user.id
+        if BOT_API['download_limit'] and (document.file_size or 0) > BOT_API['download_limit']:
+            message.reply_text(f'The video is too big, only videos up to {BOT_API["download_limit"] / 1024 ** 2:.0f} '
+                               f'MB can be converted.')
+            return
+
         if download_mode_filter.is_zip_mode_on(user_id):
             self.add_to_zip(update, user_id, document)
             return
 
-        with CustomNamedTemporaryFile(suffix='.gif') as video_file:
-            _, orig_path, compressed_path = self.download_video_to_file(bot, document, video_file, video_file.name)
-
-            uploader.connect()
-            upload_path = UPLOADER.get('url', None) or UPLOADER['configuration'].get('path', None) or ''
-
-            upload_orig_file_name = 'xenian-{}.gif'.format(str(uuid4())[:8])
-            uploader.upload(orig_path, upload_orig_file_name)
-
-            orig_host_path = upload_path + '/' + upload_orig_file_name
-
-            compressed_host_path = None
-            if os.path.isfile(compressed_path):
-                upload_compressed_file_name = 'xenian-{}-min.gif'.format(str(uuid4())[:8])
-                uploader.upload(compressed_path, upload_compressed_file_name)
-                compressed_host_path = upload_path + '/' + upload_compressed_file_name
-
-            # If the host path a local path we can't send it as an URL, so we send the gif just as a ZIP file.
-            if os.path.isfile(orig_host_path):
-                with TemporaryDirectory() as temp_folder:
-                    zip_content_path = os.path.join(temp_folder, 'zip_content')
-                    os.mkdir(zip_content_path)
-                    uploader.upload(orig_host_path, zip_content_path)
-                    if compressed_host_path:
-                        uploader.upload(compressed_host_path, zip_content_path)
-
-                    zip_path = os.path.join(temp_folder, os.path.basename(orig_host_path))
-                    os.chmod(zip_content_path, 0o40755)
-                    created_zip = shutil.make_archive(zip_path, format='zip', root_dir=zip_content_path, base_dir='.')
-                    if os.path.getsize(created_zip) > 52428800:
-                        message.reply_text('File is too big, sorry!', reply_to_message_id=message.message_id)
-                    else:
-                        with open(created_zip, mode='br') as zip_file:
-                            message.reply_document(zip_file, filename=os.path.basename(created_zip),
-                                                   reply_to_message_id=message.message_id)
+        def convert(job: Job):
+            with CustomNamedTemporaryFile(suffix='.gif') as video_file:
+                _, orig_path, compressed_path = self.download_video_to_file(bot, document, video_file, video_file.name)
+
+                uploader.connect()
+                upload_path = UPLOADER.get('url', None) or UPLOADER['configuration'].get('path', None) or ''
+
+                upload_orig_file_name = 'xenian-{}.gif'.format(str(uuid4())[:8])
+                uploader.upload(orig_path, upload_orig_file_name)
+
+                orig_host_path = upload_path + '/' + upload_orig_file_name
+
+                compressed_host_path = None
+                if os.path.isfile(compressed_path):
+                    upload_compressed_file_name = 'xenian-{}-min.gif'.format(str(uuid4())[:8])
+                    uploader.upload(compressed_path, upload_compressed_file_name)
+                    compressed_host_path = upload_path + '/' + upload_compressed_file_name
+
+                # If the host path a local path we can't send it as an URL, so we send the gif just as a ZIP file.
+                if os.path.isfile(orig_host_path):
+                    with TemporaryDirectory() as temp_folder:
+                        with ZipBuilder(temp_folder, os.path.basename(orig_host_path),
+                                        max_bytes=BOT_API['upload_limit']) as archive:
+                            archive.add_file(orig_host_path, os.path.basename(orig_host_path))
+                            if compressed_host_path:
+                                archive.add_file(compressed_host_path, os.path.basename(compressed_host_path))
+                        send_archive(message, archive)
+                    uploader.close()
+                    return
                 uploader.close()
-                return
-            uploader.close()
 
-            downloadable_file = compressed_host_path or orig_host_path
+                downloadable_file = compressed_host_path or orig_host_path
 
-            reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("Download GIF", url=downloadable_file), ], ])
-            message.reply_photo(downloadable_file, 'Instant GIF Download', reply_markup=reply_markup,
-                                reply_to_message_id=message.message_id)
+                reply_markup = InlineKeyboardMarkup([[InlineKeyboardButton("Download GIF", url=downloadable_file), ], ])
+                message.reply_photo(downloadable_file, 'Instant GIF Download', reply_markup=reply_markup,
+                                    reply_to_message_id=message.message_id)
+
+        conversion_job(bot, user_id, message.chat_id, 'GIF conversion', convert, message.message_id)
 
     @run_async
     def download(self, bot: Bot, update: Update):
@@ -325,34 +442,36 @@ download = Download()
 
 
 class VideoDownloader(BaseCommand):
-    keyboard_message_id = {}
-    """Keyboard message chat id of current download
+    sessions = TimeoutCache(timeout=VIDEO_DOWNLOADER['session_timeout'], max_size=VIDEO_DOWNLOADER['max_sessions'])
+    """Download menus the users are currently in
 
-    Key must always be user_id
+    Key must always be user_id. Possible menus: 'format', 'audio', 'video', 'video_quality', 'audio_quality'.
+    Sessions expire when they are not used. Each session is persisted on its own in mongodb when it changes, so menus
+    keep working after a restart.
 
     Examples:
-        keyboard_message_id = {
-            'some_user': 'message_id'
+        sessions = {
+            'some_user': {
+                'menu': 'video',
+                'message_id': 'keyboard message id',
+                'video_information': {...},  # See compact_video_information
+                'playlist_url': 'url'  # Only if the link was part of a playlist
+            }
         }
     """
 
-    current_menu = {}
-    """Which menu the user is in
+    info_cache = TimeoutCache(timeout=VIDEO_DOWNLOADER['info_timeout'], max_size=256)
+    """Compact video information by normalized url"""
 
-    Key must always be user_id
-    Possible menus: 'format', 'audio', 'video', 'video_quality', 'audio_quality'
+    download_links = TimeoutCache(timeout=1800, max_size=256)
+    """Download links of files which were too big for Telegram by url and format, as long as the files exist"""
 
-    Examples:
-        current_menu = {
-            'some_user': 'video'
-        }
-    """
+    _download_locks = {}
+    _download_locks_lock = Lock()
+    _playlist_slots = BoundedSemaphore(PLAYLIST['max_downloads'])
 
-    video_information = {}
-    """Extracted video information
-
-    Key must always be user_id
-    """
+    upload_limit = BOT_API['upload_limit']
+    """Maximum size of files sent directly to the user"""
 
     group = 'Download'
 
@@ -385,10 +504,63 @@ class VideoDownloader(BaseCommand):
                 'handler': CallbackQueryHandler,
                 'options': {'pattern': '^download'},
                 'hidden': True
+            },
+            {
+                'description': 'Download the whole playlist',
+                'command': self.download_playlist,
+                'handler': CallbackQueryHandler,
+                'options': {'pattern': '^playlist'},
+                'hidden': True
             }
         ]
         super(VideoDownloader, self).__init__()
 
+        self.downloads = mongodb_database.video_downloads
+        self.stored_sessions = mongodb_database.video_downloader_sessions
+        self.stored_sessions.create_index([('user_id', ASCENDING)], unique=True)
+        self.stored_sessions.create_index([('expires', ASCENDING)], expireAfterSeconds=0)
+
+        now = datetime.utcnow()
+        for document in self.stored_sessions.find({'expires': {'$gt': now}}):
+            self.sessions.set(document['user_id'], json.loads(document['session']),
+                              timeout=(document['expires'] - now).total_seconds())
+
+    def save_session(self, user_id: int, session: dict or None):
+        """Store or remove the session of a user and persist it
+
+        Args:
+            user_id (:obj:`int`): Id of a user
+            session (:obj:`dict`): The session or :obj:`None` to remove it
+        """
+        if session is None:
+            self.sessions.pop(user_id)
+            self.stored_sessions.delete_one({'user_id': user_id})
+            return
+
+        self.sessions.set(user_id, session)
+        # Stored as json, as the keys of the video information are not all valid mongodb keys
+        expires = datetime.utcnow() + timedelta(seconds=self.sessions.timeout)
+        self.stored_sessions.update_one({'user_id': user_id},
+                                        {'$set': {'user_id': user_id, 'session': json.dumps(session),
+                                                  'expires': expires}},
+                                        upsert=True)
+
+    def get_session(self, update: Update) -> dict or None:
+        """Get the session of the user, tell the user if it expired
+
+        Args:
+            update (:obj:`telegram.update.Update`): Telegram Api Update Object
+
+        Returns:
+            :obj:`dict`: The session or :obj:`None` if it expired
+        """
+        session = self.sessions.get(update.effective_user.id)
+        if session is None and update.callback_query:
+            update.callback_query.answer(text='This menu has expired, please send the link again.')
+            message = update.effective_message
+            message.edit_text(text=message.text_html, parse_mode=ParseMode.HTML)
+        return session
+
     @run_async
     def video_from_url(self, bot: Bot, update: Update):
         """Download video from URL
@@ -399,49 +571,240 @@ class VideoDownloader(BaseCommand):
         """
         user_id = update.message.from_user.id
 
-        if self.video_information.get(user_id, None):
+        if self.sessions.get(user_id):
             self.abort(bot, update)
 
         chat_id = update.message.chat_id
-        url = urldefrag(update.message.text).url
-        # Remove potential playlist argument from url
-        url = re.sub('([&?])list=.*(&|$)', '\g<1>', url)
-
-        with youtube_dlc.YoutubeDL({}) as ydl:
-            try:
-                info = ydl.extract_info(url, download=False)
-            except DownloadError:
-                return
-            info['short_description'] = re.sub(r'\n\s*\n', '\n', (info.get('description', '') or ''))
-            self.video_information[user_id] = info
-            keyboard = self.get_keyboard('format', info)
+        url = self.normalize_url(update.message.text)
 
-            self.current_menu[user_id] = 'format'
-            self.keyboard_message_id[user_id] = bot.send_message(
-                chat_id=chat_id,
-                text='<a href="{webpage_url}">&#8205;</a>'
-                     '{extractor_key:-^20}\n'
-                     '<b>{uploader} - {title}</b>\n'
-                     '{short_description:.150}...'.format(**info),
-                parse_mode=ParseMode.HTML,
-                disable_web_page_preview=False,
-                reply_markup=keyboard
-            ).result()
+        try:
+            info = self.info_cache.get_or_set(url, lambda: self.extract_video_information(url))
+        except DownloadError:
+            return
+        session = {'menu': 'format', 'video_information': info}
+        if PLAYLIST['max_entries'] and 'list' in dict(parse_qsl(urlsplit(update.message.text.strip()).query)):
+            session['playlist_url'] = update.message.text.strip()
+        keyboard = self.get_keyboard('format', info, playlist='playlist_url' in session)
+
+        message = bot.send_message(
+            chat_id=chat_id,
+            text='<a href="{webpage_url}">&#8205;</a>'
+                 '{extractor_key:-^20}\n'
+                 '<b>{uploader} - {title}</b>\n'
+                 '{short_description:.150}...'.format(**info),
+            parse_mode=ParseMode.HTML,
+            disable_web_page_preview=False,
+            reply_markup=keyboard
+        ).result()
+        session['message_id'] = message.message_id
+        self.save_session(user_id, session)
 
     @run_async
     def download(self, bot: Bot, update: Update):
         """Download video from URL
 
+        Identical downloads requested at the same time are only downloaded once, the other users wait and get the
+        already uploaded file.
+
         Args:
             bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
             update (:obj:`telegram.update.Update`): Telegram Api Update Object
         """
+        session = self.get_session(update)
+        if not session:
+            return
+
         user_id = update.effective_user.id
         chat_id = update.effective_chat.id
-        url = self.video_information[user_id]['webpage_url']
+        url = session['video_information']['webpage_url']
         data = update.callback_query.data.split(' ')
         message = update.effective_message
 
+        format_id = data[2]
+        if format_id == 'fits':
+            format_id = (session['video_information']['fitting'] or (None, None))[0]
+            if not format_id:
+                bot.send_message(chat_id=chat_id,
+                                 text='No format fits into Telegram, downloading the best one instead.')
+                format_id = 'best'
+        format_id, extract_audio = self.resolve_format(data[1], format_id)
+
+        # Remove buttons
+        message.edit_text(text=message.text_html, parse_mode=ParseMode.HTML)
+        self.save_session(user_id, None)
+
+        self.deliver_download(bot, user_id, chat_id, url, format_id, extract_audio)
+
+    @run_async
+    def download_playlist(self, bot: Bot, update: Update):
+        """Download all videos of a playlist
+
+        A few videos are downloaded at the same time and each is sent as soon as it is finished. The amount of
+        playlist downloads and their bandwidth is limited for all users together by the PLAYLIST setting.
+
+        Args:
+            bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+            update (:obj:`telegram.update.Update`): Telegram Api Update Object
+        """
+        session = self.get_session(update)
+        if not session or not session.get('playlist_url', None):
+            return
+
+        user_id = update.effective_user.id
+        chat_id = update.effective_chat.id
+        kind = update.callback_query.data.split(' ')[1]
+        message = update.effective_message
+        format_id, extract_audio = self.resolve_format(kind, 'best')
+
+        # Remove buttons
+        message.edit_text(text=message.text_html, parse_mode=ParseMode.HTML)
+        self.save_session(user_id, None)
+
+        def download_entries(job: Job):
+            try:
+                urls = self.playlist_entries(session['playlist_url'])
+            except DownloadError:
+                bot.send_message(chat_id=chat_id, text='The playlist could not be loaded.')
+                return
+
+            progress_bar = TelegramProgressBar(
+                bot=bot,
+                chat_id=chat_id,
+                full_amount=len(urls),
+                pre_message='Downloading playlist\n{current} / {total}',
+            )
+            progress_bar.start()
+
+            ratelimit = PLAYLIST['rate_limit'] / PLAYLIST['max_downloads'] if PLAYLIST['rate_limit'] else None
+
+            def download_entry(url: str):
+                with self._playlist_slots:
+                    job.check()
+                    self.deliver_download(bot, user_id, chat_id, url, format_id, extract_audio, job=job, quiet=True,
+                                          ratelimit=ratelimit)
+
+            failed = 0
+            with ThreadPoolExecutor(max_workers=PLAYLIST['workers']) as executor:
+                futures = [executor.submit(job.wrap(download_entry), url) for url in urls]
+                try:
+                    for done, future in enumerate(as_completed(futures), start=1):
+                        job.check()
+                        try:
+                            future.result()
+                        except DownloadError:
+                            failed += 1
+                        progress_bar.update(new_amount=done)
+                finally:
+                    for future in futures:
+                        future.cancel()
+
+            if failed:
+                bot.send_message(chat_id=chat_id, text=f'{failed} videos of the playlist could not be downloaded.')
+
+        conversion_job(bot, user_id, chat_id, 'Playlist download', download_entries)
+
+    def playlist_entries(self, playlist_url: str) -> list:
+        """Get the urls of the videos in a playlist without extracting the videos themselves
+
+        Args:
+            playlist_url (:obj:`str`): Url of the playlist or of a video in the playlist
+
+        Returns:
+            :obj:`list`: Urls of the videos, at most as many as set in PLAYLIST
+
+        Raises:
+            youtube_dlc.DownloadError: If the playlist could not be extracted
+        """
+        options = {'extract_flat': 'in_playlist', 'noplaylist': False, 'playlistend': PLAYLIST['max_entries']}
+        with youtube_dlc.YoutubeDL(options) as ydl:
+            info = ydl.extract_info(playlist_url, download=False)
+
+        entries = info.get('entries', None) or [info]
+        urls = [entry.get('webpage_url', None) or entry.get('url', None) for entry in entries]
+        return [url for url in urls if url][:PLAYLIST['max_entries']]
+
+    def resolve_format(self, kind: str, format_id: str) -> tuple:
+        """Get the youtube_dlc format selector for a choice in the menu
+
+        Args:
+            kind (:obj:`str`): Either video, audio or video_audio
+            format_id (:obj:`str`): A format id or ``best``
+
+        Returns:
+            :obj:`tuple`: The format selector and if the audio has to be extracted
+        """
+        if format_id != 'best':
+            return format_id, False
+
+        if kind == 'video':
+            return 'bestvideo/best', False
+        elif kind == 'audio':
+            # An aac stream can be remuxed into m4a without transcoding
+            return 'bestaudio[ext=m4a]/bestaudio' if AUDIO['codec'] in ['best', 'm4a'] else 'bestaudio', True
+        return 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best', False  # best mp4 wiht best m4a
+
+    def deliver_download(self, bot: Bot, user_id: int, chat_id: int, url: str, format_id: str, extract_audio: bool,
+                         job: Job = None, quiet: bool = False, ratelimit: int = None):
+        """Send a video to the user, download it only if it was not downloaded before
+
+        Identical downloads requested at the same time are only downloaded once, the other users wait and get the
+        already uploaded file.
+
+        Args:
+            bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+            user_id (:obj:`int`): Id of the user
+            chat_id (:obj:`int`): Id of the chat the file is sent to
+            url (:obj:`str`): Url of the video
+            format_id (:obj:`str`): youtube_dlc format selector
+            extract_audio (:obj:`bool`): Extract the audio as defined in the AUDIO setting
+            job (:obj:`xenian.bot.utils.jobs.Job`, optional): Job the download is part of, by default the download
+                is queued in its own job and this returns immediately
+            quiet (:obj:`bool`, optional): Do not send progress messages
+            ratelimit (:obj:`int`, optional): Maximum download speed in bytes per sec
+        """
+        format_key = f'{format_id} {AUDIO["codec"]} {AUDIO["quality"]}' if extract_audio else format_id
+
+        if job is None:
+            result = self.find_download(url, format_key)
+            if result:
+                self.send_download(bot, chat_id, result)
+                return
+
+            conversion_job(bot, user_id, chat_id, 'Download',
+                           lambda download_job: self.deliver_download(bot, user_id, chat_id, url, format_id,
+                                                                      extract_audio, download_job, quiet, ratelimit))
+            return
+
+        with self.single_flight((url, format_key)):
+            result = self.find_download(url, format_key)
+            if result:
+                self.send_download(bot, chat_id, result)
+                return
+
+            result = self.download_and_send(bot, user_id, chat_id, url, format_id, extract_audio, job, quiet,
+                                            ratelimit)
+            if result:
+                self.store_download(url, format_key, result)
+
+    def download_and_send(self, bot: Bot, user_id: int, chat_id: int, url: str, format_id: str, extract_audio: bool,
+                          job: Job, quiet: bool = False, ratelimit: int = None) -> dict or None:
+        """Download a video and send it to the user
+
+        Args:
+            bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+            user_id (:obj:`int`): Id of the user
+            chat_id (:obj:`int`): Id of the chat the file is sent to
+            url (:obj:`str`): Url of the video
+            format_id (:obj:`str`): youtube_dlc format selector
+            extract_audio (:obj:`bool`): Extract the audio as defined in the AUDIO setting
+            job (:obj:`xenian.bot.utils.jobs.Job`): Job the download is part of
+            quiet (:obj:`bool`, optional): Do not send progress messages
+            ratelimit (:obj:`int`, optional): Maximum download speed in bytes per sec
+
+        Returns:
+            :obj:`dict` or :obj:`None`: How the file was sent, ``{'file_id': ...}`` if it was sent to Telegram or
+                ``{'url': ...}`` if a download link was sent, :obj:`None` if the file could not be sent
+        """
         class DownloadHook:
             progress_bar = None
             can_send_status = True
@@ -452,7 +815,8 @@ class VideoDownloader(BaseCommand):
                 Args:
                     download_event (:obj:`dict`): Dictionary with information about the event and the file
                 """
-                if download_event['status'] == 'downloading' and self.can_send_status:
+                job.check()
+                if download_event['status'] == 'downloading' and self.can_send_status and not quiet:
                     total_amount = download_event.get('total_bytes', None)
                     downloaded = download_event['downloaded_bytes']
                     fragments = False
@@ -481,15 +845,6 @@ class VideoDownloader(BaseCommand):
                         self.can_send_status = False
                         bot.send_message(chat_id=chat_id, text='Downloading Video\nNo download status available.')
 
-        format_id = data[2]
-        if format_id == 'best':
-            if data[1] == 'video':
-                format_id = 'bestvideo/best'
-            elif data[1] == 'audio':
-                format_id = 'bestaudio'
-            elif data[1] == 'video_audio':
-                format_id = 'bestvideo[ext=mp4]+bestaudio[ext=m4a]/best[ext=mp4]/best'  # best mp4 wiht best m4a
-
         with TemporaryDirectory() as temp_dir:
             download_hook = DownloadHook()
             options = {
@@ -497,18 +852,21 @@ class VideoDownloader(BaseCommand):
                 'restrictfilenames': True,
                 'progress_hooks': [download_hook.hook],
             }
+            if quiet:
+                options['quiet'] = True
+            if ratelimit:
+                options['ratelimit'] = ratelimit
             if format_id:
                 options['format'] = format_id
 
-            if data[1] == 'audio' and data[2] == 'best':
+            if extract_audio:
+                # With "best" aac, mp3, opus and vorbis streams are only remuxed, anything else is transcoded to mp3
                 options['postprocessors'] = [{
                     'key': 'FFmpegExtractAudio',
-                    'preferredcodec': 'mp3',
-                    'preferredquality': '192',
+                    'preferredcodec': AUDIO['codec'],
+                    'preferredquality': AUDIO['quality'],
                 }]
 
-            # Remove buttons
-            message.edit_text(text=message.text_html, parse_mode=ParseMode.HTML)
             with youtube_dlc.YoutubeDL(options) as ydl:
                 ydl.download([url, ])
 
@@ -516,47 +874,113 @@ class VideoDownloader(BaseCommand):
                 file_path = os.path.join(temp_dir, filename)
 
                 file_size = os.path.getsize(file_path)
-                sent = False
-                if file_size < 5e+7:
+                if file_size < self.upload_limit:
                     try:
-                        bot.send_chat_action(chat_id=chat_id, action=ChatAction.UPLOAD_VIDEO)
-
-                        bot.send_message(chat_id=chat_id, text='Depending on the filesize the upload could take some '
-                                                               'time')
-                        bot.send_document(chat_id=chat_id, document=open(file_path, mode='rb'), filename=filename,
-                                          timeout=60)
-                        sent = True
+                        if not quiet:
+                            bot.send_chat_action(chat_id=chat_id, action=ChatAction.UPLOAD_VIDEO)
+                            bot.send_message(chat_id=chat_id, text='Depending on the filesize the upload could take '
+                                                                   'some time')
+                        with input_file(file_path) as file:
+                            sent_message = bot.send_document(chat_id=chat_id, document=file, filename=filename,
+                                                             timeout=60).result()
+                        return {'file_id': sent_message.document.file_id}
                     except (NetworkError, TimedOut, BadRequest):
                         pass
 
-                if not sent:
-                    bot.send_chat_action(chat_id=chat_id, action=ChatAction.UPLOAD_VIDEO)
-                    uploader.connect()
-                    uploader.upload(file_path, remove_after=1800)
-                    uploader.close()
-
-                    path = UPLOADER.get('url', None) or UPLOADER['configuration'].get('path', None) or ''
-                    url_path = os.path.join(path, filename)
+                bot.send_chat_action(chat_id=chat_id, action=ChatAction.UPLOAD_VIDEO)
+                uploader.connect()
+                uploader.upload(file_path, remove_after=1800)
+                uploader.close()
 
-                    if os.path.isfile(url_path):
-                        # Can not send a download link to the user if the file is stored locally without url config
-                        bot.send_message(
-                            chat_id=update.effective_chat.id,
-                            text='The file was to big to sent or for some reason could not be sent directly. Another '
-                                 'way of sending the file was not configured by the adminstrator. You can use /support '
-                                 'to contact the admins.')
-                        return
+                path = UPLOADER.get('url', None) or UPLOADER['configuration'].get('path', None) or ''
+                url_path = os.path.join(path, filename)
 
-                    keyboard = InlineKeyboardMarkup([[InlineKeyboardButton('Download', url=url_path), ], ])
+                if os.path.isfile(url_path):
+                    # Can not send a download link to the user if the file is stored locally without url config
                     bot.send_message(
-                        chat_id=update.effective_chat.id,
-                        text='File was either too big for Telegram or could for some reason not be sent directly, '
-                             'please use this download button',
-                        reply_markup=keyboard)
+                        chat_id=chat_id,
+                        text='The file was to big to sent or for some reason could not be sent directly. Another '
+                             'way of sending the file was not configured by the adminstrator. You can use /support '
+                             'to contact the admins.')
+                    return
+
+                result = {'url': url_path}
+                self.send_download(bot, chat_id, result)
+                return result
 
-                self.current_menu.pop(user_id, None)
-                self.keyboard_message_id.pop(user_id, None)
-                self.video_information.pop(user_id, None)
+    def send_download(self, bot: Bot, chat_id: int, result: dict):
+        """Send an already downloaded file to a user
+
+        Args:
+            bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+            chat_id (:obj:`int`): Id of the chat the file is sent to
+            result (:obj:`dict`): Either ``{'file_id': ...}`` or ``{'url': ...}``
+        """
+        if result.get('file_id', None):
+            bot.send_document(chat_id=chat_id, document=result['file_id'])
+            return
+
+        keyboard = InlineKeyboardMarkup([[InlineKeyboardButton('Download', url=result['url']), ], ])
+        bot.send_message(
+            chat_id=chat_id,
+            text='File was either too big for Telegram or could for some reason not be sent directly, '
+                 'please use this download button',
+            reply_markup=keyboard)
+
+    def find_download(self, url: str, format_key: str) -> dict or None:
+        """Find an earlier download of the same video and format
+
+        Args:
+            url (:obj:`str`): Url of the video
+            format_key (:obj:`str`): Format selector and post processing of the download
+
+        Returns:
+            :obj:`dict` or :obj:`None`: The stored result of :meth:`download_and_send`
+        """
+        result = self.download_links.get((url, format_key))
+        if result:
+            return result
+
+        document = self.downloads.find_one({'url': url, 'format': format_key})
+        if document:
+            return {'file_id': document['file_id']}
+
+    def store_download(self, url: str, format_key: str, result: dict):
+        """Store a download so it can be sent again without downloading it
+
+        Telegram file ids are kept, links only as long as the uploaded file exists.
+
+        Args:
+            url (:obj:`str`): Url of the video
+            format_key (:obj:`str`): Format selector and post processing of the download
+            result (:obj:`dict`): The result of :meth:`download_and_send`
+        """
+        if result.get('file_id', None):
+            self.downloads.update_one({'url': url, 'format': format_key},
+                                      {'$set': {'url': url, 'format': format_key, 'file_id': result['file_id']}},
+                                      upsert=True)
+        else:
+            self.download_links.set((url, format_key), result)
+
+    @contextmanager
+    def single_flight(self, key: tuple):
+        """Lock a download, so identical downloads run one after another
+
+        Args:
+            key (:obj:`tuple`): Url and format of the download
+        """
+        with self._download_locks_lock:
+            key_lock = self._download_locks.setdefault(key, [Lock(), 0])
+            key_lock[1] += 1
+
+        try:
+            with key_lock[0]:
+                yield
+        finally:
+            with self._download_locks_lock:
+                key_lock[1] -= 1
+                if not key_lock[1]:
+                    self._download_locks.pop(key, None)
 
     def menu_change(self, bot: Bot, update: Update):
         """Menu changes
@@ -565,16 +989,21 @@ class VideoDownloader(BaseCommand):
             bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
             update (:obj:`telegram.update.Update`): Telegram Api Update Object
         """
+        session = self.get_session(update)
+        if not session:
+            return
+
         user_id = update.callback_query.from_user.id
         text = update.callback_query.data
 
-        keyboard = self.get_keyboard(text, self.video_information[user_id])
+        keyboard = self.get_keyboard(text, session['video_information'], playlist='playlist_url' in session)
         bot.edit_message_reply_markup(
             chat_id=update.effective_chat.id,
-            message_id=self.keyboard_message_id[user_id].message_id,
+            message_id=session['message_id'],
             reply_markup=keyboard)
 
-        self.current_menu[user_id] = text
+        session['menu'] = text
+        self.save_session(user_id, session)
 
     def abort(self, bot: Bot, update: Update):
         """Abort
@@ -583,54 +1012,62 @@ class VideoDownloader(BaseCommand):
             bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
             update (:obj:`telegram.update.Update`): Telegram Api Update Object
         """
+        session = self.get_session(update)
+        if not session:
+            return
+
         user_id = update.effective_user.id
-        text = 'Aborted {}'.format(self.video_information[user_id]['title'])
+        text = 'Aborted {}'.format(session['video_information']['title'])
         if update.callback_query:
             update.callback_query.answer(text=text)
 
-        message = update.effective_message
-        # Remove buttons
-        message.edit_text(text=message.text_html, parse_mode=ParseMode.HTML)
+            message = update.effective_message
+            # Remove buttons
+            message.edit_text(text=message.text_html, parse_mode=ParseMode.HTML)
+        else:
+            try:
+                bot.edit_message_reply_markup(chat_id=update.effective_chat.id,
+                                              message_id=session['message_id']).result()
+            except BadRequest:
+                pass
 
-        self.current_menu.pop(user_id, None)
-        self.keyboard_message_id.pop(user_id, None)
-        self.video_information.pop(user_id, None)
+        self.save_session(user_id, None)
 
-    def get_keyboard(self, keyboard_name: str, video_information: dict) -> InlineKeyboardMarkup:
+    def get_keyboard(self, keyboard_name: str, video_information: dict, playlist: bool = False) -> InlineKeyboardMarkup:
         """Get inline keyboard list
 
         Args:
-            keyboard_name (:obj:`str`): For available names look in the description for current_menu
-            video_information (:obj:`dict`): Information about the video
+            keyboard_name (:obj:`str`): For available names look in the description for sessions
+            video_information (:obj:`dict`): Information about the video from :meth:`compact_video_information`
+            playlist (:obj:`bool`, optional): Offer to download the playlist the video is part of
 
         Returns:
             :class:`telegram.inline.inlinekeyboardmarkup.InlineKeyboardMarkup`: InlineKeyboardMarkup with the new menu
         """
-        formats = {}
-        if video_information.get('formats', None):
-            for format_ in video_information['formats']:
-                formats[format_['format_id']] = {
-                    'ext': format_.get('ext', None),
-                    'video': format_['vcodec'] if format_.get('vcodec', 'none') != 'none' else None,
-                    'audio': format_['acodec'] if format_.get('acodec', 'none') != 'none' else None,
-                    'filesize': format_.get('filesize', None),
-                    'res':
-                        '%sx%s' % (format_['width'], format_['height'])
-                        if format_.get('height', None) and format_.get('width', None)
-                        else None,
-                    'vcodec': format_.get('vcodec', None),
-                    'acodec': format_.get('acodec', None),
-                    'abr': '%sk' % format_['abr'] if format_.get('abr', None) else None,
-                }
+        formats = video_information['formats']
 
         keyboard = []
         if keyboard_name == 'format':
             if formats:
-                if [format_ for format_ in formats.values() if format_['audio']]:
+                if [kind for _, kind, _ in formats if kind == 'audio']:
                     keyboard.append([InlineKeyboardButton('Audio Only', callback_data='audio'), ])
-                if [format_ for format_ in formats.values() if format_['video']]:
+                if [kind for _, kind, _ in formats if kind == 'video']:
                     keyboard.append([InlineKeyboardButton('Video Only', callback_data='video'), ])
-            keyboard.append([InlineKeyboardButton('Best', callback_data='download video_audio best'), ])
+
+            best_size = video_information['best_size']
+            keyboard.append([InlineKeyboardButton(f'Best{self.size_label(best_size)}',
+                                                  callback_data='download video_audio best'), ])
+
+            fitting = video_information['fitting']
+            if fitting and (best_size is None or best_size >= self.upload_limit):
+                keyboard.append([InlineKeyboardButton(f'Best fitting Telegram{self.size_label(fitting[1])}',
+                                                      callback_data='download video_audio fits'), ])
+
+            if playlist:
+                keyboard.append([
+                    InlineKeyboardButton('Whole Playlist', callback_data='playlist video_audio'),
+                    InlineKeyboardButton('Whole Playlist (Audio)', callback_data='playlist audio'),
+                ])
 
         elif keyboard_name in ['video', 'audio']:
             name = keyboard_name.title().replace('_', ' + ')
@@ -660,32 +1097,192 @@ class VideoDownloader(BaseCommand):
 
         return InlineKeyboardMarkup(keyboard)
 
-    def get_advance_keyboard(self, advance_menu: str, formats: dict) -> list:
+    def get_advance_keyboard(self, advance_menu: str, formats: list) -> list:
         """Get advanced keyboard for audio, video or audio + video
 
         Args:
             advance_menu (:obj:`str`): Which menud you want audio, video or video_audio
-            formats (:obj:`dict`): Dict with the format information
+            formats (:obj:`list`): List of format id, kind and label as in :meth:`compact_video_information`
         Returns:
             :obj:`list`: List of lists containing :class:`telegram.inline.inlinekeyboardbutton.InlineKeyboardButton`
         """
         keyboard = []
 
-        for format_id, format_ in formats.items():
-            if (advance_menu == 'audio' and format_['video']) or \
-                    (advance_menu == 'video' and format_['audio']) or \
-                    (advance_menu == 'video_audio' and (not format_['video'] or not format_['audio'])):
+        for format_id, kind, label in formats:
+            if kind != advance_menu:
                 continue
 
-            text = ''
-            for key, value in format_.items():
-                if key not in ['video', 'filesize', 'audio'] and value not in ['none', ] and value:
-                    text += '{key}: {value} '.format(key=key, value=value)
-            text = text.strip()
             keyboard.append(
-                [InlineKeyboardButton(text=text, callback_data='download {} {}'.format(advance_menu, format_id)), ]
+                [InlineKeyboardButton(text=label, callback_data='download {} {}'.format(advance_menu, format_id)), ]
             )
         return keyboard
 
+    @staticmethod
+    def normalize_url(url: str) -> str:
+        """Normalize an url so the same video always has the same url
+
+        Args:
+            url (:obj:`str`): The url
+
+        Returns:
+            :obj:`str`: The url without fragment, playlist and tracking arguments and with a lowercase host
+        """
+        parts = urlsplit(urldefrag(url.strip()).url)
+        query = [(key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                 if key not in ['list', 'index'] and not key.startswith('utm_')]
+        return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), parts.path, urlencode(query), ''))
+
+    def extract_video_information(self, url: str) -> dict:
+        """Extract the compact information about a video
+
+        Args:
+            url (:obj:`str`): Url of the video
+
+        Returns:
+            :obj:`dict`: Information from :meth:`compact_video_information`
+
+        Raises:
+            youtube_dlc.DownloadError: If the information could not be extracted
+        """
+        with youtube_dlc.YoutubeDL({}) as ydl:
+            return self.compact_video_information(ydl.extract_info(url, download=False))
+
+    def compact_video_information(self, info: dict) -> dict:
+        """Reduce the extracted video information to what the menus need
+
+        The full information contains every format, thumbnail and subtitle and can be megabytes in size. The formats
+        are parsed into button labels once here instead of on every menu change.
+
+        Args:
+            info (:obj:`dict`): Information about the video extracted by youtube_dlc
+
+        Returns:
+            :obj:`dict`: The compact information, JSON serializable
+        """
+        duration = info.get('duration', None)
+
+        formats = []
+        for format_ in info.get('formats', None) or []:
+            video = format_['vcodec'] if format_.get('vcodec', 'none') != 'none' else None
+            audio = format_['acodec'] if format_.get('acodec', 'none') != 'none' else None
+            if not video and not audio:
+                continue
+
+            details = {
+                'ext': format_.get('ext', None),
+                'res':
+                    '%sx%s' % (format_['width'], format_['height'])
+                    if format_.get('height', None) and format_.get('width', None)
+                    else None,
+                'vcodec': format_.get('vcodec', None),
+                'acodec': format_.get('acodec', None),
+                'abr': '%sk' % format_['abr'] if format_.get('abr', None) else None,
+            }
+            label = ''
+            for key, value in details.items():
+                if value not in ['none', ] and value:
+                    label += '{key}: {value} '.format(key=key, value=value)
+            label = (label + self.size_label(self.estimate_size(format_, duration))).strip()
+
+            kind = 'video_audio' if video and audio else 'video' if video else 'audio'
+            formats.append([format_['format_id'], kind, label])
+
+        best_size = self.estimate_size(info, duration)
+        if not best_size and info.get('requested_formats', None):
+            sizes = [self.estimate_size(format_, duration) for format_ in info['requested_formats']]
+            best_size = sum(sizes) if all(sizes) else None
+
+        return {
+            'webpage_url': info['webpage_url'],
+            'extractor_key': info.get('extractor_key', None) or '',
+            'uploader': info.get('uploader', None) or '',
+            'title': info.get('title', None) or '',
+            'short_description': re.sub(r'\n\s*\n', '\n', (info.get('description', '') or ''))[:150],
+            'formats': formats,
+            'best_size': best_size,
+            'fitting': self.fitting_format(info),
+        }
+
+    def fitting_format(self, video_information: dict) -> tuple or None:
+        """Find the best format with video and audio which can be sent directly to the user
+
+        Formats containing video and audio as well as combinations of a video only with an audio only format are
+        considered. The sizes are estimated from the format information, so no download is needed.
+
+        Args:
+            video_information (:obj:`dict`): Information about the video
+
+        Returns:
+            :obj:`tuple` or :obj:`None`: The format selector like ``137+140`` and the estimated size in bytes or
+                :obj:`None` if no format fits
+        """
+        # Leave some space for the container and inaccurate estimates
+        max_size = self.upload_limit * 0.95
+        duration = video_information.get('duration', None)
+
+        combined, videos, audios = [], [], []
+        for format_ in video_information.get('formats', None) or []:
+            size = self.estimate_size(format_, duration)
+            if not size:
+                continue
+            has_video = format_.get('vcodec', 'none') != 'none'
+            has_audio = format_.get('acodec', 'none') != 'none'
+            quality = (format_.get('height', None) or 0, format_.get('tbr', None) or 0)
+
+            if has_video and has_audio:
+                combined.append((quality, size, format_['format_id']))
+            elif has_video:
+                videos.append((quality, size, format_['format_id']))
+            elif has_audio:
+                audios.append((format_.get('abr', None) or format_.get('tbr', None) or 0, size, format_['format_id']))
+
+        candidates = [candidate for candidate in combined if candidate[1] <= max_size]
+        for video_quality, video_size, video_id in videos:
+            fitting_audios = [audio for audio in audios if video_size + audio[1] <= max_size]
+            if fitting_audios:
+                audio_quality, audio_size, audio_id = max(fitting_audios)
+                candidates.append((video_quality + (audio_quality, ), video_size + audio_size,
+                                   f'{video_id}+{audio_id}'))
+
+        if not candidates:
+            return None
+        _, size, format_id = max(candidates, key=lambda candidate: (candidate[0], -candidate[1]))
+        return format_id, size
+
+    @staticmethod
+    def estimate_size(format_: dict, duration: int or float = None) -> int or None:
+        """Estimate the file size of a format
+
+        Args:
+            format_ (:obj:`dict`): Information about the format
+            duration (:obj:`int` or :obj:`float`, optional): Duration of the video in sec
+
+        Returns:
+            :obj:`int` or :obj:`None`: Size in bytes or :obj:`None` if it is not known
+        """
+        size = format_.get('filesize', None) or format_.get('filesize_approx', None)
+        if size:
+            return int(size)
+
+        # Bitrates are in kbit/s
+        bitrate = format_.get('tbr', None) or (format_.get('vbr', None) or 0) + (format_.get('abr', None) or 0)
+        if bitrate and duration:
+            return int(bitrate * 1000 / 8 * duration)
+        return None
+
+    @staticmethod
+    def size_label(size: int or None) -> str:
+        """Label for an estimated size in buttons
+
+        Args:
+            size (:obj:`int`): Size in bytes
+
+        Returns:
+            :obj:`str`: Label like `` (~12.3 MB)`` or an empty string if the size is not known
+        """
+        if not size:
+            return ''
+        return ' (~{:.1f} MB)'.format(size / 1000000)
+
 
 video_downloader = VideoDownloader()
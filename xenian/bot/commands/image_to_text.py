@@ -1,13 +1,11 @@
-import io
-
 import pytesseract
 from PIL import Image
 from pytesseract import TesseractError
-from telegram import Bot, ParseMode, Update
+from telegram import Bot, ParseMode, PhotoSize, Update
 from telegram.ext import run_async
 
 from xenian.bot.settings import IMAGE_TO_TEXT_LANG
-from xenian.bot.utils import get_option_from_string
+from xenian.bot.utils import cached_artifact, cached_download, get_option_from_string
 from . import translate
 from .base import BaseCommand
 
@@ -76,16 +74,11 @@ class ImageToText(BaseCommand):
 
         lang, text = get_option_from_string('l', update.message.text)
 
-        photo = bot.getFile(reply_to_message.photo[-1].file_id)
-        with io.BytesIO() as image_buffer:
-            photo.download(out=image_buffer)
-
-            pil_image = Image.open(image_buffer)
-            try:
-                text = self.extract_text(pil_image, lang)
-            except TesseractError:
-                update.message.reply_text('Either the given language is not supported or there was another error.\n'
-                                          'See all languages with /itt_lang.')
+        try:
+            text = self.image_text(bot, reply_to_message.photo[-1], lang)
+        except TesseractError:
+            update.message.reply_text('Either the given language is not supported or there was another error.\n'
+                                      'See all languages with /itt_lang.')
 
         if text:
             reply = '*This text was found:*\n\n{}'.format(text)
@@ -110,16 +103,11 @@ class ImageToText(BaseCommand):
         lang_from, text = get_option_from_string('lf', update.message.text)
         lang_to, text = get_option_from_string('lt', update.message.text)
 
-        photo = bot.getFile(reply_to_message.photo[-1].file_id)
-        with io.BytesIO() as image_buffer:
-            photo.download(out=image_buffer)
-
-            pil_image = Image.open(image_buffer)
-            try:
-                text = self.extract_text(pil_image, lang_from)
-            except TesseractError:
-                update.message.reply_text('Either the given language is not supported or there was another error.\n'
-                                          'See all languages with /itt_lang.')
+        try:
+            text = self.image_text(bot, reply_to_message.photo[-1], lang_from)
+        except TesseractError:
+            update.message.reply_text('Either the given language is not supported or there was another error.\n'
+                                      'See all languages with /itt_lang.')
 
         if text:
             translated = translate.translate_text(text, lang_to=lang_to)
@@ -133,6 +121,29 @@ class ImageToText(BaseCommand):
 
         update.message.reply_text(reply, parse_mode=ParseMode.MARKDOWN)
 
+    def image_text(self, bot: Bot, photo: PhotoSize, lang: str = None) -> str:
+        """Extract text from a Telegram photo
+
+        The text is cached by photo and language, so the same photo is only processed once.
+
+        Args:
+            bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+            photo (:obj:`telegram.photosize.PhotoSize`): The photo
+            lang (:obj:`str`): What is the language on the image
+
+        Returns:
+            :obj:`str`: Text found in image
+        """
+        def create(path):
+            with cached_download(bot, photo, '.jpg') as image_path:
+                text = self.extract_text(Image.open(image_path), lang)
+            with open(path, mode='w', encoding='utf-8') as text_file:
+                text_file.write(text)
+
+        with cached_artifact(photo.file_unique_id, 'ocr', create, '.txt', {'lang': lang}) as text_path:
+            with open(text_path, encoding='utf-8') as text_file:
+                return text_file.read()
+
     def extract_text(self, image: object or Image, lang: str = None) -> str:
         """Extract text from an image
 
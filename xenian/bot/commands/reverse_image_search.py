@@ -6,6 +6,8 @@ from telegram.error import Unauthorized
 from telegram.ext import Filters, run_async
 from telegram.ext.messagehandler import MessageHandler
 from telegram.utils.promise import Promise
+
+from xenian.bot import mongodb_database
 from xenian.bot.commands.filters import download_mode_filter
 from xenian.bot.commands.reverse_image_search_engines import (
     BingReverseImageSearchEngine,
@@ -16,7 +18,8 @@ from xenian.bot.commands.reverse_image_search_engines import (
     TraceReverseImageSearchEngine,
     YandexReverseImageSearchEngine,
 )
-from xenian.bot.utils import auto_download
+from xenian.bot.settings import REVERSE_IMAGE_SEARCH_UPLOAD
+from xenian.bot.utils import PerceptualHashIndex, auto_download, dhash, hamming_distance, shrink_image
 
 from . import BaseCommand
 
@@ -24,11 +27,25 @@ __all__ = ["reverse_image_search"]
 
 
 class ReverseImageSearch(BaseCommand):
-    """Reverse Image Search integration for this bot"""
+    """Reverse Image Search integration for this bot
+
+    Attributes:
+        image_lifetime (:obj:`int`): How long an uploaded image is kept on the server in sec
+        hash_index (:obj:`PerceptualHashIndex`): Uploaded images by their perceptual hash, so the same image does not
+            have to be uploaded again.
+        verify_distance (:obj:`int`): Maximum hamming distance of the detailed 256 bit hashes for an image found in
+            the hash_index to be reused
+    """
 
     group = "Image"
+    image_lifetime = 3600
+    verify_distance = 8
 
     def __init__(self):
+        # Only identical 64 bit hashes are looked up, the detailed hash stored with them verifies the match, as images
+        # of different users must never be mixed up
+        self.hash_index = PerceptualHashIndex(mongodb_database.reverse_image_search_hashes, max_distance=0)
+
         self.commands = [
             {
                 "title": "Auto Search",
@@ -86,6 +103,7 @@ class ReverseImageSearch(BaseCommand):
             message = update.message.reply_text(
                 "Please wait for the media file to be processed..."
             )
+            message.result()
         except Unauthorized:
             user = update.effective_user
             print(f"Bot was blocked by {user.username or user.full_name}")
@@ -110,9 +128,66 @@ class ReverseImageSearch(BaseCommand):
             message (:obj:`telegram.message.Message`, optional): An message object to update. Instead of sending a new
         """
 
-        image_extension = os.path.splitext(media_file)[1]
-        image_name = "irs-" + str(uuid4())[:8]
+        image_hash = dhash(media_file)
+        verify_hash = dhash(media_file, hash_size=16)
+        known_image = self.hash_index.find(image_hash)
+        if known_image and self.is_same_image(known_image, verify_hash):
+            self.send_search_buttons(bot, update, known_image["image_url"], message)
+            return
+
+        with shrink_image(media_file, **REVERSE_IMAGE_SEARCH_UPLOAD) as upload_file:
+            image_extension = os.path.splitext(upload_file)[1]
+            image_name = "irs-" + str(uuid4())[:8]
+
+            image_url = IQDBReverseImageSearchEngine().upload_image(
+                upload_file, image_name + image_extension, remove_after=self.image_lifetime
+            )
+
+        if os.path.isfile(image_url):
+            reply = "This bot is not configured for this functionality, contact an admin for more information /support."
+            message = message.result()
+            if message:
+                message.edit_text(reply, reply_to_message_id=update.message.message_id)
+            else:
+                update.message.reply_text(
+                    reply, reply_to_message_id=update.message.message_id
+                )
+            return
+
+        # Keep a margin so that we never hand out an url which is about to be removed
+        self.hash_index.add(
+            image_hash,
+            {"image_url": image_url, "verify_hash": "%064x" % verify_hash},
+            timeout=self.image_lifetime - 300,
+        )
+        self.send_search_buttons(bot, update, image_url, message)
+
+    def is_same_image(self, known_image: dict, verify_hash: int) -> bool:
+        """Check if an image found in the hash index is the same as the searched one
+
+        Args:
+            known_image (:obj:`dict`): Data of the entry found in the hash index
+            verify_hash (:obj:`int`): 256 bit difference hash of the searched image
 
+        Returns:
+            :obj:`bool`: True if the uploaded image of the entry can be reused
+        """
+        if not known_image.get("verify_hash"):
+            return False
+        distance = hamming_distance(int(known_image["verify_hash"], 16), verify_hash)
+        return distance <= self.verify_distance
+
+    def send_search_buttons(
+        self, bot: Bot, update: Update, image_url: str, message: Promise = None
+    ):
+        """Send the reverse image search links for an uploaded image
+
+        Args:
+            bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+            update (:obj:`telegram.update.Update`): Telegram Api Update Object
+            image_url (:obj:`str`): Url to the uploaded image
+            message (:obj:`telegram.message.Message`, optional): An message object to update. Instead of sending a new
+        """
         (
             iqdb_search,
             google_search,
@@ -131,21 +206,6 @@ class ReverseImageSearch(BaseCommand):
             TraceReverseImageSearchEngine(),
         )
 
-        image_url = iqdb_search.upload_image(
-            media_file, image_name + image_extension, remove_after=3600
-        )
-
-        if os.path.isfile(image_url):
-            reply = "This bot is not configured for this functionality, contact an admin for more information /support."
-            message = message.result()
-            if message:
-                message.edit_text(reply, reply_to_message_id=update.message.message_id)
-            else:
-                update.message.reply_text(
-                    reply, reply_to_message_id=update.message.message_id
-                )
-            return
-
         button_list = [
             [InlineKeyboardButton(text="Go To Image", url=image_url)],
             [
@@ -19,8 +19,6 @@ class ReverseImageSearchEngine:
         url_path (:obj:`str`): The url path to the actual reverse image search function. The google url would look like
             this: `/searchbyimage?&image_url={image_url}`
         name (:obj:`str`): Name of thi search engine
-        search_html (:obj:`str`): The html of the last searched image
-        search_url (:obj:`str`): The image url of the last searched image
 
     Args:
         url_base (:obj:`str`): The base url of the image search engine eg. `https://www.google.com`
@@ -32,9 +30,6 @@ class ReverseImageSearchEngine:
     name = 'Base Reverse Image Search Engine'
     logger = logging.getLogger(__name__)
 
-    search_html = None
-    search_url = None
-
     def __init__(self, url_base, url_path, name=None):
         self.url_base = url_base
         self.url_path = url_path
@@ -52,8 +47,6 @@ class ReverseImageSearchEngine:
         Returns:
             :obj:`str`: Generated reverse image search engine for the given image
         """
-        self.search_url = url
-        self.search_html = ''
         return self.url_base + self.url_path.format(image_url=quote_plus(url))
 
     def get_search_link_by_file(self, file_) -> str:
@@ -94,31 +87,19 @@ class ReverseImageSearchEngine:
         path = UPLOADER.get('url', None) or UPLOADER['configuration'].get('path', None) or ''
         return os.path.join(path, file_name)
 
-    def get_html(self, url=None) -> str:
+    def get_html(self, url: str) -> str:
         """Get the HTML of the image search site.
 
         Args:
-            url (:obj:`str`, optional): Link to the image, if no url is given it takes the last searched image url
+            url (:obj:`str`): Link to the image
 
         Returns:
             :obj:`str`: HTML of the image search site
-
-        Raises:
-            ValueError: If no url is defined and no last_searched_url is available
         """
-        if not url:
-            if not self.search_url:
-                raise ValueError('No url defined and no last_searched_url available!')
-            url = self.search_url
-        if url == self.search_url and self.search_html:
-            return self.search_html
-
         request = requests.get(self.get_search_link_by_url(url))
-        self.search_html = request.text
-        return self.search_html
+        return request.text
 
-    @property
-    def best_match(self) -> dict:
+    def best_match(self, html: str) -> dict:
         """Get info about the best matching image found
 
         Notes:
@@ -137,6 +118,9 @@ class ReverseImageSearchEngine:
             }
             ```
 
+        Args:
+            html (:obj:`str`): HTML of the image search site
+
         Returns:
             :obj:`dict`: Dictionary of the found image
 
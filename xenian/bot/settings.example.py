@@ -29,9 +29,28 @@ ANIME_SERVICES = [
         'hashed_string': None,
         'username': None,
         'password': None,
+        # 'timeout': 10,  # Optional for each service: Sec to wait for /booru results, default BOORU['search_timeout']
     }
 ]
 
+# How single booru images are sent: 'both' as compressed photo with the original file as document as reply, 'photo' or
+# 'document' for only one of them, which halves the uploads of images stored locally. Videos are always documents.
+BOORU = {
+    'send_mode': 'both',
+    # Images exceeding the Telegram photo limits are downsized for sending them as photo, the original is still sent as
+    # document and in zips
+    'resize_processes': 2,
+    'photo_max_edge': 2560,  # Telegram does not show photos larger than this anyway
+    'photo_quality': 90,
+    'search_timeout': 10,  # Services which do not answer /booru in time are left out
+    'search_workers': 8,  # Searches on the services run in this many threads shared by all users
+    # Search results get a button for the next page, which is prefetched with its first prefetch_images images while
+    # the user looks at the current page (only the post list for images sent by url). Only the last search of a user
+    # can be continued for next_page_timeout sec.
+    'next_page_timeout': 10 * 60,
+    'prefetch_workers': 2,
+    'prefetch_images': 3,
+}
 
 ADMINS = ['@SOME_TELEGRAM_USERS', ]  # Users which can do admin tasks like /restart
 SUPPORTER = ['@SOME_TELEGRAM_USERS', ]  # Users which to contact fo support
@@ -51,6 +70,29 @@ MODE = {
     },
 }
 
+# The public Bot API limits uploads to 50 MB and downloads to 20 MB. With a self-hosted Bot API server in --local mode
+# (https://github.com/tdlib/telegram-bot-api) files up to 2000 MB are sent by their path and files from Telegram are
+# read directly from the server's directory, which must be accessible from the bot.
+BOT_API = {
+    'base_url': None,  # For example 'http://localhost:8081/bot', None for the public Bot API
+    'base_file_url': None,  # For example 'http://localhost:8081/file/bot'
+    'local': False,  # If the server runs in --local mode on this machine
+    'upload_limit': 50 * 1024 ** 2,  # 2000 * 1024 ** 2 with a local server
+    'download_limit': 20 * 1024 ** 2,  # No limit (None) with a local server
+}
+
+# Outgoing messages are sent by priority (replies, menus, media, progress bars) within the limits of Telegram: About 30
+# messages per sec overall, 1 per sec in a private chat and 20 per min in a group. Flooded chats are paused on their
+# own.
+MESSAGE_SCHEDULER = {
+    'workers': 4,  # Messages sent at the same time
+    'global_rate': 30,
+    'private_rate': 1,
+    'private_burst': 3,
+    'group_rate': 20 / 60,
+    'group_burst': 5,
+}
+
 UPLOADER = {
     'uploader': 'xenian.bot.uploaders.ssh.SSHUploader',  # What uploader to use
     'url': 'YOUR_DOMAIN_FILES_DIR',
@@ -63,6 +105,106 @@ UPLOADER = {
     }
 }
 
+# Files downloaded from Telegram are cached on the disk, so the same file is only downloaded once
+MEDIA_CACHE = {
+    'path': os.path.join(BASE_DIR, 'var/cache/media'),
+    'max_bytes': 2 * 1024 ** 3,
+}
+
+# Files converted from Telegram files (GIFs, PNG stickers, first frames, OCR text) are cached on the disk as well
+ARTIFACT_CACHE = {
+    'path': os.path.join(BASE_DIR, 'var/cache/artifacts'),
+    'max_bytes': 2 * 1024 ** 3,
+}
+
+# Videos are converted to GIFs with ffmpeg, larger videos are scaled down and reduced in fps
+GIF_CONVERSION = {
+    'fps': 20,
+    'max_width': 640,  # in px
+}
+
+# Converted GIFs are compressed to the best quality below max_bytes, searching at most time_budget sec with the given
+# amount of parallel gifsicle processes
+GIF_OPTIMIZATION = {
+    'max_bytes': 50 * 1024 ** 2,  # Telegram upload limit
+    'time_budget': 120,
+    'workers': 4,
+}
+
+# Format of downloaded static stickers: png or webp (lossless). compress_level is the compression effort, 0 - 9 for png
+# and 0 - 6 for webp. Animated and video stickers are downloaded as gifs, animated stickers need the lottie package.
+STICKER_CONVERSION = {
+    'format': 'png',
+    'compress_level': 6,
+}
+
+# /sticker_pack downloads the stickers of a pack with download_workers threads and converts them in a pool of
+# conversion_processes processes
+STICKER_PACK = {
+    'download_workers': 8,
+    'conversion_processes': 4,
+}
+
+# Zip mode downloads and converts up to workers files of a zip at the same time. Zips larger than the Telegram upload
+# limit are split into volumes, if more than max_volumes would be needed the download is stopped.
+ZIP_MODE = {
+    'workers': 2,
+    'max_volumes': 4,
+}
+
+# Menus of the video downloader expire after session_timeout sec without use, at most max_sessions are kept. Extracted
+# video information is reused for info_timeout sec.
+VIDEO_DOWNLOADER = {
+    'session_timeout': 60 * 60,
+    'max_sessions': 1000,
+    'info_timeout': 10 * 60,
+}
+
+# Audio downloads: with codec "best" the native audio stream is remuxed into a playable container (aac to m4a, opus,
+# vorbis to ogg, mp3) and only transcoded to mp3 if that is not possible. Set it to mp3, m4a or opus to always get that
+# codec. quality is the bitrate in kbit/s used when transcoding.
+AUDIO = {
+    'codec': 'best',
+    'quality': '192',
+}
+
+# Links to videos in a playlist can download the whole playlist, up to max_entries videos (0 to disable). workers videos
+# of a playlist are downloaded at the same time, max_downloads for all playlists together, sharing rate_limit bytes/s
+# (None for no limit).
+PLAYLIST = {
+    'max_entries': 50,
+    'workers': 2,
+    'max_downloads': 4,
+    'rate_limit': 20 * 1024 ** 2,
+}
+
+# Progress bars are edited at most every min_interval sec unless the progress changed by min_delta (0.1 = 10%)
+PROGRESS_BAR = {
+    'min_interval': 3,
+    'min_delta': 0.1,
+}
+
+# Downloads and conversions are queued once max_jobs run at the same time or the user already has max_jobs_per_user
+# running. Jobs running longer than timeout sec are cancelled.
+CONVERSION_JOBS = {
+    'max_jobs': 4,
+    'max_jobs_per_user': 1,
+    'timeout': 15 * 60,
+}
+
+# Images are shrunk and re-encoded before they are uploaded for reverse image searches
+REVERSE_IMAGE_SEARCH_UPLOAD = {
+    'max_edge': 1280,  # Longest edge in px, search engines do not need more
+    'format': 'jpeg',  # jpeg or webp
+    'quality': 85,
+}
+
+# How the first frame of videos and GIFs is retrieved for reverse image searches
+REVERSE_IMAGE_SEARCH_FIRST_FRAME = {
+    'min_thumbnail_edge': 320,  # Use the Telegram thumbnail if its longest edge has at least this many px
+    'partial_download_bytes': 2 * 1024 * 1024,  # Otherwise try to find the first keyframe in this many bytes
+}
+
 LOG_LEVEL = logging.INFO
 
 # These Instagram credentials are used for the centralized Instagram account which automatically follows private
@@ -1,8 +1,18 @@
 from .file import *
 from .temp_file import *
+from .archive import *
 from .cache import *
+from .file_cache import *
+from .perceptual_hash import *
+from .image import *
 from .data import *
+from .message_scheduler import *
 from .progress_bar import *
 from .telegram import *
+from .bot_api import *
 from .template import *
+from .jobs import *
+from .video import *
+from .gif import *
+from .sticker import *
 from .telegram_files import *
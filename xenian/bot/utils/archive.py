@@ -0,0 +1,150 @@
+import os
+import time
+from threading import Lock
+from zipfile import ZIP_DEFLATED, ZIP_STORED, ZipFile, ZipInfo
+
+__all__ = ['ZipBuilder', 'COMPRESSED_EXTENSIONS']
+
+COMPRESSED_EXTENSIONS = {
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.mp4', '.webm', '.mkv', '.mov', '.mp3', '.m4a', '.ogg', '.opus',
+    '.zip', '.gz', '.tgs',
+}
+"""(:obj:`set`): Extensions of already compressed files, which are stored without compressing them again"""
+
+# Local header, central directory entry and their zip64 extra fields of a member without its name
+_MEMBER_OVERHEAD = 30 + 46 + 2 * 32
+# End of central directory record with its zip64 variant and locator
+_ARCHIVE_OVERHEAD = 22 + 56 + 20
+
+
+class ZipBuilder:
+    """Build zip archives member by member, split into volumes with a maximum size
+
+    Members are written directly into the archive, data in memory does not need a temporary file. Already compressed
+    media is stored as is, everything else is deflated. Each volume is a complete zip archive on its own, so no special
+    tool is needed to extract them. Volumes are only created if the members do not fit into one archive.
+
+    Examples:
+        >>> with ZipBuilder('/tmp', 'downloads', max_bytes=50 * 1024 ** 2) as archive:
+        >>>     archive.add_file('image.png', 'image.png')
+        >>>     archive.add_data('{"id": 1}', 'image.png.json')
+        >>> archive.volumes
+        >>> # ['/tmp/downloads.zip']
+
+    Attributes:
+        directory (:obj:`str`): Directory the archives are saved in
+        name (:obj:`str`): Name of the archive without extension
+        max_bytes (:obj:`int`): Maximum size of a volume, :obj:`None` for no limit
+        volumes (:obj:`list`): Paths to the created archives, only complete after :meth:`close`
+        skipped (:obj:`list`): Names of members which were larger than ``max_bytes`` on their own and were left out
+
+    Args:
+        directory (:obj:`str`): Directory the archives are saved in
+        name (:obj:`str`): Name of the archive without extension
+        max_bytes (:obj:`int`, optional): Maximum size of a volume, by default there is no limit
+    """
+
+    def __init__(self, directory: str, name: str, max_bytes: int = None):
+        self.directory = directory
+        self.name = name
+        self.max_bytes = max_bytes
+        self.volumes = []
+        self.skipped = []
+
+        self._zip_file = None
+        self._central_size = 0
+        self._closed_size = 0
+        self._lock = Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def size(self) -> int:
+        """:obj:`int`: Size of all volumes in bytes"""
+        with self._lock:
+            return self._closed_size + self._current_size()
+
+    def add_file(self, path: str, arcname: str):
+        """Add a file to the archive
+
+        Args:
+            path (:obj:`str`): Path to the file
+            arcname (:obj:`str`): Name of the file in the archive
+        """
+        with self._lock:
+            if self._reserve(arcname, os.path.getsize(path)):
+                self._zip_file.write(path, arcname, compress_type=self._compress_type(arcname))
+
+    def add_data(self, data: bytes or str, arcname: str):
+        """Add data from memory to the archive
+
+        Args:
+            data (:obj:`bytes` or :obj:`str`): Content of the file, strings are encoded as utf-8
+            arcname (:obj:`str`): Name of the file in the archive
+        """
+        if isinstance(data, str):
+            data = data.encode()
+
+        with self._lock:
+            if self._reserve(arcname, len(data)):
+                info = ZipInfo(arcname, date_time=time.localtime()[:6])
+                info.compress_type = self._compress_type(arcname)
+                info.external_attr = 0o644 << 16
+                self._zip_file.writestr(info, data)
+
+    def close(self) -> list:
+        """Finish the archive
+
+        If everything fit into a single volume it is named ``<name>.zip``, otherwise the volumes are numbered like
+        ``<name>.001.zip``.
+
+        Returns:
+            :obj:`list`: Paths to the volumes
+        """
+        with self._lock:
+            self._close_volume()
+            if len(self.volumes) == 1 and self.volumes[0] != self._single_volume_path():
+                os.replace(self.volumes[0], self._single_volume_path())
+                self.volumes[0] = self._single_volume_path()
+            return self.volumes
+
+    def _reserve(self, arcname: str, size: int) -> bool:
+        required = size + _MEMBER_OVERHEAD + 2 * len(arcname.encode())
+        if self.max_bytes is not None:
+            if required + _ARCHIVE_OVERHEAD > self.max_bytes:
+                self.skipped.append(arcname)
+                return False
+            if self._zip_file and self._current_size() + required > self.max_bytes:
+                self._close_volume()
+
+        if not self._zip_file:
+            path = os.path.join(self.directory, f'{self.name}.{len(self.volumes) + 1:03}.zip')
+            self.volumes.append(path)
+            self._zip_file = ZipFile(path, mode='w', allowZip64=True)
+            self._central_size = 0
+
+        self._central_size += 46 + 32 + len(arcname.encode())
+        return True
+
+    def _current_size(self) -> int:
+        if not self._zip_file:
+            return 0
+        return self._zip_file.fp.tell() + self._central_size + _ARCHIVE_OVERHEAD
+
+    def _close_volume(self):
+        if self._zip_file:
+            self._zip_file.close()
+            self._closed_size += os.path.getsize(self.volumes[-1])
+            self._zip_file = None
+
+    def _single_volume_path(self) -> str:
+        return os.path.join(self.directory, f'{self.name}.zip')
+
+    @staticmethod
+    def _compress_type(arcname: str) -> int:
+        extension = os.path.splitext(arcname)[1].lower()
+        return ZIP_STORED if extension in COMPRESSED_EXTENSIONS else ZIP_DEFLATED
@@ -0,0 +1,88 @@
+import os
+import shutil
+from contextlib import contextmanager
+from pathlib import Path
+
+from telegram import File
+
+from xenian.bot.settings import BOT_API
+
+__all__ = ['input_file', 'local_file_path', 'download_telegram_file', 'telegram_file_bytes']
+
+
+@contextmanager
+def input_file(path: str):
+    """Get a file for uploading to Telegram
+
+    With a local Bot API server the server reads the file itself, so only its path is sent. Otherwise the file is
+    opened and its content uploaded. Either way the file must exist until the message was sent, so wait for the result
+    of scheduled messages before leaving the with statement.
+
+    Examples:
+        >>> with input_file(video_path) as video:
+        >>>     bot.send_document(chat_id, document=video).result()
+
+    Args:
+        path (:obj:`str`): Path to the file
+
+    Returns:
+        :obj:`str` or :obj:`io.BufferedReader`: A ``file://`` URI or the opened file
+    """
+    if BOT_API['local']:
+        yield Path(path).resolve().as_uri()
+        return
+
+    with open(path, 'rb') as file:
+        yield file
+
+
+def local_file_path(telegram_file: File) -> str or None:
+    """Get the path of a Telegram file on this machine
+
+    A local Bot API server returns absolute paths instead of download links, which python-telegram-bot prefixes with
+    ``base_file_url``.
+
+    Args:
+        telegram_file (:obj:`telegram.file.File`): The file
+
+    Returns:
+        :obj:`str` or :obj:`None`: The path or :obj:`None` if the file has to be downloaded
+    """
+    if not BOT_API['local'] or not telegram_file.file_path:
+        return None
+
+    path = telegram_file.file_path
+    prefix = telegram_file.bot.base_file_url + '/'
+    if path.startswith(prefix):
+        path = path[len(prefix):]
+    return path if os.path.isabs(path) and os.path.isfile(path) else None
+
+
+def download_telegram_file(telegram_file: File, path: str):
+    """Save a Telegram file to the given path, copied directly if it is on this machine
+
+    Args:
+        telegram_file (:obj:`telegram.file.File`): The file
+        path (:obj:`str`): Where to save the file
+    """
+    local_path = local_file_path(telegram_file)
+    if local_path:
+        shutil.copyfile(local_path, path)
+    else:
+        telegram_file.download(custom_path=path)
+
+
+def telegram_file_bytes(telegram_file: File) -> bytes:
+    """Get the content of a Telegram file, read directly if it is on this machine
+
+    Args:
+        telegram_file (:obj:`telegram.file.File`): The file
+
+    Returns:
+        :obj:`bytes`: Content of the file
+    """
+    local_path = local_file_path(telegram_file)
+    if local_path:
+        with open(local_path, 'rb') as file:
+            return file.read()
+    return bytes(telegram_file.download_as_bytearray())
@@ -1,6 +1,9 @@
 import time
+from collections import OrderedDict
+from threading import Lock, RLock
+from typing import Any, Callable, Hashable
 
-__all__ = ['MWT']
+__all__ = ['MWT', 'TimeoutCache']
 
 
 class MWT(object):
@@ -41,3 +44,155 @@ class MWT(object):
         func.func_name = f.__name__
 
         return func
+
+
+class TimeoutCache:
+    """Thread safe cache whose entries expire after a timeout and which holds at most ``max_size`` entries
+
+    When the cache is full the least recently used entry is dropped.
+
+    Examples:
+        >>> cache = TimeoutCache(timeout=60, max_size=2)
+        >>> cache.set('foo', 1)
+        >>> cache.get('foo')
+        >>> # 1
+        >>> cache.get_or_set('bar', lambda: expensive_call())
+
+    Attributes:
+        timeout (:obj:`int` or :obj:`float`): Lifetime of an entry in sec
+        max_size (:obj:`int`): Maximum amount of entries
+
+    Args:
+        timeout (:obj:`int` or :obj:`float`): Lifetime of an entry in sec
+        max_size (:obj:`int`, optional): Maximum amount of entries, defaults to 128
+    """
+
+    def __init__(self, timeout: int or float, max_size: int = 128):
+        self.timeout = timeout
+        self.max_size = max_size
+
+        self._entries = OrderedDict()
+        self._lock = RLock()
+        self._key_locks = {}
+
+    def __len__(self) -> int:
+        with self._lock:
+            self.collect()
+            return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, _missing) is not _missing
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Get an entry which has not yet timed out
+
+        Args:
+            key (:obj:`Hashable`): Key of the entry
+            default (:obj:`Any`, optional): Returned if the entry does not exist or has timed out
+
+        Returns:
+            :obj:`Any`: The cached value or the default
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[1] < time.time():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return entry[0]
+
+    def set(self, key: Hashable, value: Any, timeout: int or float = None):
+        """Add or replace an entry
+
+        Args:
+            key (:obj:`Hashable`): Key of the entry
+            value (:obj:`Any`): Value to be cached
+            timeout (:obj:`int` or :obj:`float`, optional): Lifetime of this entry in sec, defaults to
+                :attr:`timeout`
+        """
+        expires = time.time() + (self.timeout if timeout is None else timeout)
+        with self._lock:
+            self._entries[key] = (value, expires)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self.collect()
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def get_or_set(self, key: Hashable, factory: Callable[[], Any], timeout: int or float = None) -> Any:
+        """Get an entry or create it with the factory if it does not exist
+
+        Concurrent calls for the same key wait for the first one instead of running the factory themselves.
+
+        Args:
+            key (:obj:`Hashable`): Key of the entry
+            factory (:obj:`Callable`): Called without arguments to create the value
+            timeout (:obj:`int` or :obj:`float`, optional): Lifetime of this entry in sec, defaults to
+                :attr:`timeout`
+
+        Returns:
+            :obj:`Any`: The cached or newly created value
+        """
+        value = self.get(key, _missing)
+        if value is not _missing:
+            return value
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, [Lock(), 0])
+            key_lock[1] += 1
+
+        try:
+            with key_lock[0]:
+                value = self.get(key, _missing)
+                if value is _missing:
+                    value = factory()
+                    self.set(key, value, timeout=timeout)
+                return value
+        finally:
+            with self._lock:
+                key_lock[1] -= 1
+                if not key_lock[1]:
+                    self._key_locks.pop(key, None)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an entry
+
+        Args:
+            key (:obj:`Hashable`): Key of the entry
+            default (:obj:`Any`, optional): Returned if the entry does not exist or has timed out
+
+        Returns:
+            :obj:`Any`: The removed value or the default
+        """
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None or entry[1] < time.time():
+            return default
+        return entry[0]
+
+    def items(self) -> list:
+        """Get all entries which have not yet timed out, for example to persist them
+
+        Returns:
+            :obj:`list`: Tuples of key, value and the time the entry expires as unix timestamp
+        """
+        with self._lock:
+            self.collect()
+            return [(key, value, expires) for key, (value, expires) in self._entries.items()]
+
+    def collect(self):
+        """Remove entries which have timed out"""
+        now = time.time()
+        with self._lock:
+            for key in [key for key, (_, expires) in self._entries.items() if expires < now]:
+                del self._entries[key]
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._entries.clear()
+
+
+_missing = object()
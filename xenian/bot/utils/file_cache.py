@@ -0,0 +1,200 @@
+import os
+from collections import OrderedDict
+from contextlib import contextmanager
+from tempfile import NamedTemporaryFile
+from threading import Lock, RLock
+from typing import Callable
+
+__all__ = ['FileCache']
+
+
+class FileCache:
+    """Cache of files on the disk with a byte budget
+
+    When the budget is exceeded the least recently used files are removed. Files which are currently in use are never
+    removed. The last usage is stored as modification time of the files, so the order survives restarts.
+
+    Examples:
+        >>> cache = FileCache('/tmp/some_cache', max_bytes=1024 * 1024)
+        >>> with cache.get('some_key', lambda path: download_to(path), suffix='.png') as path:
+        >>>     print(open(path, 'rb').read())
+
+    Attributes:
+        path (:obj:`str`): Directory the files are stored in
+        max_bytes (:obj:`int`): Maximum size of all files together
+        hits (:obj:`int`): How many times a requested file was already cached
+        misses (:obj:`int`): How many times a requested file had to be created
+
+    Args:
+        path (:obj:`str`): Directory the files are stored in
+        max_bytes (:obj:`int`): Maximum size of all files together
+    """
+
+    def __init__(self, path: str, max_bytes: int):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+
+        self._files = OrderedDict()
+        self._size = 0
+        self._pinned = {}
+        self._key_locks = {}
+        self._lock = RLock()
+        self._loaded = False
+
+    def __contains__(self, key: str) -> bool:
+        with self._lock:
+            self._load()
+            return key in self._files
+
+    @property
+    def size(self) -> int:
+        """:obj:`int`: Size of all cached files in bytes"""
+        with self._lock:
+            self._load()
+            return self._size
+
+    def stats(self) -> dict:
+        """Get usage statistics of the cache
+
+        Returns:
+            :obj:`dict`: Amount of files, their size, the budget, hits, misses and the hit rate
+        """
+        with self._lock:
+            self._load()
+            requests = self.hits + self.misses
+            return {
+                'files': len(self._files),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / requests if requests else 0,
+            }
+
+    @contextmanager
+    def get(self, key: str, create: Callable[[str], None], suffix: str = ''):
+        """Get the path to a cached file, create the file first if it does not exist yet
+
+        The file must not be modified and is only guaranteed to exist until the end of the with statement.
+
+        Args:
+            key (:obj:`str`): Unique key of the file, must be usable as file name
+            create (:obj:`Callable`): Called with a path, must write the file to this path
+            suffix (:obj:`str`, optional): Suffix of the file name like ``.png``, only used when creating the file
+
+        Returns:
+            :obj:`str`: Path to the file
+        """
+        created = False
+        file_path = self._pin(key)
+        if file_path is None:
+            with self._lock:
+                key_lock = self._key_locks.setdefault(key, Lock())
+
+            with key_lock:
+                file_path = self._pin(key)
+                if file_path is None:
+                    file_path = self._create(key, create, suffix)
+                    created = True
+            with self._lock:
+                self._key_locks.pop(key, None)
+
+        with self._lock:
+            if created:
+                self.misses += 1
+            else:
+                self.hits += 1
+
+        try:
+            yield file_path
+        finally:
+            self._unpin(key)
+
+    def remove(self, key: str):
+        """Remove a file from the cache
+
+        Args:
+            key (:obj:`str`): Unique key of the file
+        """
+        with self._lock:
+            self._load()
+            if key in self._files:
+                self._remove(key)
+
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+
+        os.makedirs(self.path, exist_ok=True)
+        files = []
+        for entry in os.scandir(self.path):
+            if entry.is_file() and not entry.name.startswith('.'):
+                stat = entry.stat()
+                files.append((stat.st_mtime, os.path.splitext(entry.name)[0], entry.path, stat.st_size))
+
+        for _, key, file_path, size in sorted(files):
+            self._files[key] = (file_path, size)
+            self._size += size
+        self._evict()
+
+    def _pin(self, key: str) -> str or None:
+        with self._lock:
+            self._load()
+            entry = self._files.get(key)
+            if entry is None:
+                return None
+            if not os.path.isfile(entry[0]):
+                self._remove(key)
+                return None
+
+            self._files.move_to_end(key)
+            self._pinned[key] = self._pinned.get(key, 0) + 1
+            try:
+                os.utime(entry[0])
+            except OSError:
+                pass
+            return entry[0]
+
+    def _unpin(self, key: str):
+        with self._lock:
+            self._pinned[key] -= 1
+            if not self._pinned[key]:
+                del self._pinned[key]
+            self._evict()
+
+    def _create(self, key: str, create: Callable[[str], None], suffix: str) -> str:
+        file_path = os.path.join(self.path, key + suffix)
+        with NamedTemporaryFile(dir=self.path, prefix='.', suffix=suffix, delete=False) as temp_file:
+            temp_path = temp_file.name
+        try:
+            create(temp_path)
+            os.replace(temp_path, file_path)
+        finally:
+            if os.path.isfile(temp_path):
+                os.unlink(temp_path)
+
+        with self._lock:
+            size = os.path.getsize(file_path)
+            self._files[key] = (file_path, size)
+            self._size += size
+            self._pinned[key] = self._pinned.get(key, 0) + 1
+            self._evict()
+        return file_path
+
+    def _evict(self):
+        for key in list(self._files):
+            if self._size <= self.max_bytes:
+                return
+            if key not in self._pinned:
+                self._remove(key)
+
+    def _remove(self, key: str):
+        file_path, size = self._files.pop(key)
+        self._size -= size
+        try:
+            os.unlink(file_path)
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,97 @@
+import os
+import shutil
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from tempfile import TemporaryDirectory
+
+from . import Job, current_job, run_process
+
+__all__ = ['optimize_gif']
+
+LOSSY_LEVELS = [0, 30, 50, 80, 120, 160, 200]
+COLOR_COUNTS = [256, 128, 64]
+SCALES = [1, 0.75, 0.5, 0.35]
+
+GIF_LADDER = [(lossy, colors, scale) for scale in SCALES for colors in COLOR_COUNTS for lossy in LOSSY_LEVELS]
+"""(:obj:`list`): gifsicle settings as (lossy, colors, scale) ordered from best quality to smallest output"""
+
+
+def optimize_gif(gif_path: str, output_path: str, max_bytes: int, time_budget: int or float = 60,
+                 workers: int = 4) -> bool:
+    """Compress a gif to the best quality which is smaller than the given size
+
+    The settings in :obj:`GIF_LADDER` are searched for the best quality output below ``max_bytes``. Every round up to
+    ``workers`` candidates are encoded at the same time by gifsicle processes and the search range is narrowed down
+    around them, like a binary search with more than one probe.
+
+    Args:
+        gif_path (:obj:`str`): Path to the gif
+        output_path (:obj:`str`): Path where the compressed gif is saved to
+        max_bytes (:obj:`int`): Maximum size of the compressed gif
+        time_budget (:obj:`int` or :obj:`float`, optional): Maximum time in sec to search. Running gifsicle processes
+            are killed when the time is up.
+        workers (:obj:`int`, optional): How many gifsicle processes run at the same time
+
+    Returns:
+        :obj:`bool`: True if a compressed gif smaller than ``max_bytes`` was found and saved to ``output_path``
+
+    Raises:
+        JobCancelled: If the job of the current thread was cancelled, its gifsicle processes are killed
+    """
+    job = current_job()
+    deadline = time.monotonic() + time_budget
+    low, high = 0, len(GIF_LADDER)
+    best_path = None
+
+    with TemporaryDirectory() as temp_dir, ThreadPoolExecutor(max_workers=workers) as executor:
+        def encode(index: int) -> str or None:
+            candidate_path = os.path.join(temp_dir, f'{index}.gif')
+            if _gifsicle(gif_path, candidate_path, *GIF_LADDER[index], timeout=deadline - time.monotonic(),
+                         job=job):
+                return candidate_path
+
+        while low < high and time.monotonic() < deadline:
+            span = high - low
+            count = min(workers, span)
+            indices = sorted(set(low + span * number // count for number in range(count)))
+            results = dict(zip(indices, executor.map(encode, indices)))
+
+            fitting = [index for index in indices
+                       if results[index] and os.path.getsize(results[index]) <= max_bytes]
+            if fitting:
+                high = fitting[0]
+                best_path = results[high]
+
+            too_large = [index for index in indices if index < high and results[index]]
+            if too_large:
+                low = too_large[-1] + 1
+            elif not fitting:
+                # Nothing could be encoded in time
+                break
+
+        if not best_path:
+            return False
+        shutil.move(best_path, output_path)
+        return True
+
+
+def _gifsicle(source: str, destination: str, lossy: int, colors: int, scale: float, timeout: float,
+              job: Job = None) -> bool:
+    if timeout <= 0:
+        return False
+
+    command = ['gifsicle', '-O3', '-o', destination]
+    if lossy:
+        command.append(f'--lossy={lossy}')
+    if colors < 256:
+        command.append(f'--colors={colors}')
+    if scale != 1:
+        command.append(f'--scale={scale}')
+    command.append(source)
+
+    try:
+        result = run_process(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, timeout=timeout, job=job)
+    except (subprocess.TimeoutExpired, FileNotFoundError):
+        return False
+    return result.returncode == 0 and os.path.isfile(destination)
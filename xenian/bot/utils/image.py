@@ -0,0 +1,114 @@
+from contextlib import contextmanager
+from io import BytesIO
+from tempfile import NamedTemporaryFile
+
+from PIL import Image, ImageOps
+
+__all__ = ['shrink_image', 'photo_fits', 'fit_photo', 'PHOTO_LIMITS']
+
+PHOTO_LIMITS = {
+    'max_bytes': 10 * 1024 ** 2,
+    'max_url_bytes': 5 * 1024 ** 2,
+    'max_dimensions': 10000,
+    'max_ratio': 20,
+}
+"""(:obj:`dict`): Limits of Telegram for photos: Size of uploaded photos and photos sent by url, sum of width and height
+and ratio of the longer to the shorter edge"""
+
+
+@contextmanager
+def shrink_image(image_path: str, max_edge: int = 1280, format: str = 'jpeg', quality: int = 85):
+    """Downsize and re-encode an image
+
+    The image is scaled down so that its longest edge is at most ``max_edge`` pixels, the EXIF rotation is applied and
+    all metadata is stripped. Transparent images are flattened onto a white background when saved as JPEG.
+
+    Args:
+        image_path (:obj:`str`): Path to the image
+        max_edge (:obj:`int`, optional): Maximum length of the longest edge in px
+        format (:obj:`str`, optional): Either ``jpeg`` or ``webp``
+        quality (:obj:`int`, optional): Encoder quality between 1 and 100
+
+    Returns:
+        :obj:`str`: Path to the shrunk image
+    """
+    format = format.lower()
+    if format not in ['jpeg', 'webp']:
+        raise ValueError(f'Image format must either be jpeg or webp not {format}')
+
+    with Image.open(image_path) as image:
+        image = ImageOps.exif_transpose(image)
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+
+        if format == 'jpeg':
+            image = _flatten(image)
+
+        options = {'optimize': True, 'progressive': True} if format == 'jpeg' else {'method': 4}
+        with NamedTemporaryFile(suffix='.jpg' if format == 'jpeg' else '.webp') as image_file:
+            image.save(image_file, format=format, quality=quality, **options)
+            image_file.flush()
+            yield image_file.name
+
+
+def photo_fits(width: int = None, height: int = None, file_size: int = None, by_url: bool = False) -> bool:
+    """Check if an image can be sent as Telegram photo without resizing it
+
+    Unknown values are assumed to fit.
+
+    Args:
+        width (:obj:`int`, optional): Width in px
+        height (:obj:`int`, optional): Height in px
+        file_size (:obj:`int`, optional): Size of the file in bytes
+        by_url (:obj:`bool`, optional): If the photo is sent by url, which has a lower size limit than uploads
+
+    Returns:
+        :obj:`bool`: True if the image fits the limits in :obj:`PHOTO_LIMITS`
+    """
+    max_bytes = PHOTO_LIMITS['max_url_bytes'] if by_url else PHOTO_LIMITS['max_bytes']
+    if file_size and file_size > max_bytes:
+        return False
+    return not width or not height or width + height <= PHOTO_LIMITS['max_dimensions']
+
+
+def fit_photo(data: bytes, max_edge: int = 2560, quality: int = 90) -> bytes:
+    """Downsize and re-encode an image to a JPEG fitting the Telegram photo limits
+
+    The image is scaled down to ``max_edge`` and further as long as it is too large, which Telegram compresses photos
+    to anyways. The function works on bytes so it can run in a process pool.
+
+    Args:
+        data (:obj:`bytes`): The image
+        max_edge (:obj:`int`, optional): Maximum length of the longest edge in px
+        quality (:obj:`int`, optional): JPEG quality between 1 and 100
+
+    Returns:
+        :obj:`bytes`: The JPEG
+
+    Raises:
+        ValueError: If the image is too long or wide to be sent as photo
+    """
+    with Image.open(BytesIO(data)) as image:
+        width, height = image.size
+        if max(width, height) > min(width, height) * PHOTO_LIMITS['max_ratio']:
+            raise ValueError(f'Images with a ratio above {PHOTO_LIMITS["max_ratio"]} can not be sent as photo')
+
+        max_edge = min(max_edge, PHOTO_LIMITS['max_dimensions'] * max(width, height) // (width + height))
+        image = _flatten(ImageOps.exif_transpose(image))
+        while True:
+            image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+            output = BytesIO()
+            image.save(output, format='jpeg', quality=quality, optimize=True)
+            if output.tell() <= PHOTO_LIMITS['max_bytes']:
+                return output.getvalue()
+            max_edge = int(max_edge * 0.75)
+
+
+def _flatten(image: Image.Image) -> Image.Image:
+    """Flatten transparent images onto a white background"""
+    if image.mode in ['RGB', 'L']:
+        return image
+
+    image = image.convert('RGBA')
+    background = Image.new('RGB', image.size, (255, 255, 255))
+    background.paste(image, mask=image.split()[3])
+    return background
@@ -0,0 +1,305 @@
+import logging
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import wraps
+from threading import Lock, Timer, local
+from typing import Callable
+
+from xenian.bot.settings import CONVERSION_JOBS
+
+__all__ = ['Job', 'JobCancelled', 'JobManager', 'job_manager', 'current_job', 'run_process']
+
+logger = logging.getLogger(__name__)
+
+_current = local()
+
+
+class JobCancelled(Exception):
+    """Raised in a job which was cancelled by the user or took too long"""
+
+
+class Job:
+    """A long running download or conversion of a user
+
+    Jobs are cancelled cooperatively: The work checks :meth:`check` regularly. Child processes started with
+    :func:`run_process` are killed directly when the job is cancelled.
+
+    Attributes:
+        user_id (:obj:`int`): Id of the user the job belongs to
+        name (:obj:`str`): Human readable name of the job
+        cancelled (:obj:`bool`): If the job was cancelled
+
+    Args:
+        user_id (:obj:`int`): Id of the user the job belongs to
+        name (:obj:`str`): Human readable name of the job
+    """
+
+    def __init__(self, user_id: int, name: str):
+        self.user_id = user_id
+        self.name = name
+        self.cancelled = False
+
+        self._processes = set()
+        self._lock = Lock()
+
+    def cancel(self):
+        """Cancel the job and kill its child processes"""
+        with self._lock:
+            self.cancelled = True
+            processes = list(self._processes)
+
+        for process in processes:
+            if process.poll() is None:
+                process.kill()
+
+    def check(self):
+        """Stop the work if the job was cancelled
+
+        Raises:
+            JobCancelled: If the job was cancelled
+        """
+        if self.cancelled:
+            raise JobCancelled(self.name)
+
+    def wrap(self, func: Callable) -> Callable:
+        """Make the job the job of the thread the function runs in
+
+        Use this for functions running in worker threads of a job, so their child processes are killed with the job.
+
+        Args:
+            func (:obj:`Callable`): The function
+
+        Returns:
+            :obj:`Callable`: The wrapped function
+        """
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            previous_job = current_job()
+            _current.job = self
+            try:
+                return func(*args, **kwargs)
+            finally:
+                _current.job = previous_job
+        return wrapper
+
+    def add_process(self, process: subprocess.Popen):
+        """Kill the given process when the job is cancelled
+
+        Args:
+            process (:obj:`subprocess.Popen`): A child process
+        """
+        with self._lock:
+            self._processes.add(process)
+            cancelled = self.cancelled
+        if cancelled:
+            process.kill()
+
+    def remove_process(self, process: subprocess.Popen):
+        """Stop tracking the given process
+
+        Args:
+            process (:obj:`subprocess.Popen`): A child process
+        """
+        with self._lock:
+            self._processes.discard(process)
+
+
+class JobManager:
+    """Limits how many downloads and conversions run at the same time
+
+    Jobs exceeding the limits wait in a queue in the order they were started. The jobs run in worker threads of the
+    manager, so no thread is blocked while they are queued.
+
+    Examples:
+        >>> def convert_all(job):
+        >>>     for item in items:
+        >>>         job.check()
+        >>>         convert(item)
+        >>> job_manager.submit(user_id, 'GIF conversion', convert_all, on_queued=lambda position: print(position),
+        >>>                    on_cancelled=lambda: print('cancelled'))
+
+    Attributes:
+        max_jobs (:obj:`int`): How many jobs run at the same time
+        max_jobs_per_user (:obj:`int`): How many jobs of a single user run at the same time
+        timeout (:obj:`int`): After how many sec a running job is cancelled
+
+    Args:
+        max_jobs (:obj:`int`): How many jobs run at the same time
+        max_jobs_per_user (:obj:`int`): How many jobs of a single user run at the same time
+        timeout (:obj:`int`): After how many sec a running job is cancelled
+    """
+
+    def __init__(self, max_jobs: int, max_jobs_per_user: int, timeout: int):
+        self.max_jobs = max_jobs
+        self.max_jobs_per_user = max_jobs_per_user
+        self.timeout = timeout
+
+        self._queued = []
+        self._running = []
+        self._submitted = {}
+        self._lock = Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_jobs, thread_name_prefix='job')
+
+    def submit(self, user_id: int, name: str, func: Callable[[Job], None], on_queued: Callable[[int], None] = None,
+               on_cancelled: Callable[[], None] = None) -> Job:
+        """Run a job in a worker thread as soon as the limits allow it
+
+        This returns immediately, the calling thread does not wait while the job is queued.
+
+        Args:
+            user_id (:obj:`int`): Id of the user the job belongs to
+            name (:obj:`str`): Human readable name of the job
+            func (:obj:`Callable`): The work, called with the running :obj:`Job`
+            on_queued (:obj:`Callable`, optional): Called with the position in the queue if the job has to wait
+            on_cancelled (:obj:`Callable`, optional): Called if the job was cancelled while waiting or running
+
+        Returns:
+            :obj:`Job`: The queued job
+        """
+        job = Job(user_id, name)
+
+        with self._lock:
+            self._queued.append(job)
+            self._submitted[job] = (func, on_cancelled)
+            position = None if self._can_start(job) else self._queued.index(job) + 1
+
+        if position and on_queued:
+            on_queued(position)
+
+        self._dispatch()
+        return job
+
+    def cancel(self, user_id: int) -> int:
+        """Cancel all queued and running jobs of a user
+
+        Args:
+            user_id (:obj:`int`): Id of the user
+
+        Returns:
+            :obj:`int`: Amount of cancelled jobs
+        """
+        with self._lock:
+            jobs = [job for job in self._queued + self._running if job.user_id == user_id]
+            for job in jobs:
+                job.cancel()
+        self._dispatch()
+        return len(jobs)
+
+    @contextmanager
+    def _activate(self, job: Job):
+        timer = Timer(self.timeout, job.cancel)
+        timer.daemon = True
+        timer.start()
+
+        previous_job = current_job()
+        _current.job = job
+        try:
+            # Not checked after the work, a job cancelled just after finishing has delivered its results already
+            job.check()
+            yield
+        finally:
+            _current.job = previous_job
+            timer.cancel()
+            with self._lock:
+                self._running.remove(job)
+            self._dispatch()
+
+    def _dispatch(self):
+        started, cancelled = [], []
+        with self._lock:
+            for job in list(self._queued):
+                if job.cancelled:
+                    self._queued.remove(job)
+                    cancelled.append(self._submitted.pop(job)[1])
+                elif self._can_start(job):
+                    self._queued.remove(job)
+                    self._running.append(job)
+                    started.append((job, self._submitted.pop(job)))
+
+        for job, (func, on_cancelled) in started:
+            self._executor.submit(self._run, job, func, on_cancelled)
+        for on_cancelled in cancelled:
+            if on_cancelled:
+                on_cancelled()
+
+    def _run(self, job: Job, func: Callable[[Job], None], on_cancelled: Callable[[], None] or None):
+        try:
+            with self._activate(job):
+                func(job)
+        except JobCancelled:
+            if on_cancelled:
+                on_cancelled()
+        except Exception:
+            logger.exception(f'{job.name} of user {job.user_id} failed')
+
+    def _can_start(self, job: Job) -> bool:
+        if job.cancelled:
+            return False
+        if len(self._running) >= self.max_jobs:
+            return False
+
+        for queued_job in self._queued:
+            running_of_user = len([running for running in self._running if running.user_id == queued_job.user_id])
+            if running_of_user < self.max_jobs_per_user:
+                # The first job in the queue which is allowed to run is next
+                return queued_job is job
+        return False
+
+
+def current_job() -> Job or None:
+    """Get the job running in the current thread
+
+    Returns:
+        :obj:`Job` or :obj:`None`: The job or :obj:`None` if no job is running in this thread
+    """
+    return getattr(_current, 'job', None)
+
+
+def run_process(command: list, timeout: float = None, check: bool = False, job: Job = None, input: bytes = None,
+                **kwargs) -> subprocess.CompletedProcess:
+    """Run a child process which is killed when the job it belongs to is cancelled
+
+    Works like :func:`subprocess.run`.
+
+    Args:
+        command (:obj:`list`): The command and its arguments
+        timeout (:obj:`float`, optional): Kill the process after this many sec
+        check (:obj:`bool`, optional): Raise :obj:`subprocess.CalledProcessError` if the process failed
+        job (:obj:`Job`, optional): The job the process belongs to, defaults to the job of the current thread
+        input (:obj:`bytes`, optional): Data sent to stdin of the process, stdin must be :obj:`subprocess.PIPE`
+        **kwargs: Further arguments for :class:`subprocess.Popen`
+
+    Returns:
+        :obj:`subprocess.CompletedProcess`: The finished process
+
+    Raises:
+        JobCancelled: If the job was cancelled while the process ran
+        subprocess.TimeoutExpired: If the process took longer than ``timeout``
+        subprocess.CalledProcessError: If ``check`` is set and the process failed
+    """
+    job = job or current_job()
+    if job:
+        job.check()
+
+    process = subprocess.Popen(command, **kwargs)
+    if job:
+        job.add_process(process)
+    try:
+        stdout, stderr = process.communicate(input, timeout=timeout)
+    except subprocess.TimeoutExpired:
+        process.kill()
+        process.communicate()
+        raise
+    finally:
+        if job:
+            job.remove_process(process)
+
+    if job:
+        job.check()
+    if check and process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, command, stdout, stderr)
+    return subprocess.CompletedProcess(command, process.returncode, stdout, stderr)
+
+
+job_manager = JobManager(**CONVERSION_JOBS)
@@ -0,0 +1,317 @@
+import logging
+import time
+from bisect import insort
+from concurrent.futures import ThreadPoolExecutor
+from itertools import count
+from threading import Condition, Lock, Thread
+from typing import Callable
+
+from telegram.error import RetryAfter
+from telegram.utils.promise import Promise
+
+__all__ = ['MessageScheduler', 'ScheduledPromise', 'Priority']
+
+logger = logging.getLogger(__name__)
+
+
+class Priority:
+    """Priority classes of outgoing messages, lower values are sent first"""
+    INTERACTIVE = 0
+    """Replies to the user"""
+    MENU = 1
+    """Edits of messages like inline keyboards"""
+    BULK = 2
+    """Media sent in bulk like search results"""
+    PROGRESS = 3
+    """Progress bar edits"""
+    ACTION = 4
+    """Chat actions like "sending photo...", they do not use up the rate limit of a chat"""
+
+    METHODS = {
+        'editMessageText': MENU,
+        'editMessageCaption': MENU,
+        'editMessageMedia': MENU,
+        'editMessageReplyMarkup': MENU,
+        'sendPhoto': BULK,
+        'sendDocument': BULK,
+        'sendVideo': BULK,
+        'sendAnimation': BULK,
+        'sendAudio': BULK,
+        'sendVoice': BULK,
+        'sendSticker': BULK,
+        'sendMediaGroup': BULK,
+        'sendChatAction': ACTION,
+    }
+    """(:obj:`dict`): Default priority of Bot API methods, all others are :attr:`INTERACTIVE`"""
+
+
+class ScheduledPromise(Promise):
+    """Promise of a message waiting in a :class:`MessageScheduler`
+
+    Attributes:
+        chat_id (:obj:`int` or :obj:`str`): Chat the message is sent to
+        method (:obj:`str`): Name of the Bot API method like ``sendMessage``
+        priority (:obj:`int`): One of :class:`Priority`
+        queued_at (:obj:`float`): When the message was scheduled, :func:`time.monotonic` time
+        started_at (:obj:`float`): When sending the message started the last time
+    """
+
+    def __init__(self, pooled_function: Callable, args: tuple, kwargs: dict, chat_id: int or str, method: str,
+                 priority: int):
+        super(ScheduledPromise, self).__init__(pooled_function, args, kwargs)
+        self.chat_id = chat_id
+        self.method = method
+        self.priority = priority
+        self.queued_at = time.monotonic()
+        self.started_at = None
+
+        self._callbacks = []
+        self._callbacks_lock = Lock()
+
+    def add_done_callback(self, callback: Callable[['ScheduledPromise'], None]):
+        """Call the callback with this promise once it is done, right away if it is done already
+
+        Callbacks run in the thread which sent the message, so they must not block.
+
+        Args:
+            callback (:obj:`Callable`): Called with the promise
+        """
+        with self._callbacks_lock:
+            if not self.done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def run(self):
+        """Calls the :attr:`pooled_function` callable.
+
+        Raises:
+            telegram.error.RetryAfter: If the chat is flooded, the promise is not done yet and must be run again
+        """
+        self.started_at = time.monotonic()
+        try:
+            self._result = self.pooled_function(*self.args, **self.kwargs)
+        except RetryAfter:
+            raise
+        except Exception as exc:
+            logger.warning(f'{self.method} to {self.chat_id} failed: {exc}')
+            self._exception = exc
+
+        with self._callbacks_lock:
+            self.done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception:
+                logger.exception(f'Callback of {self.method} to {self.chat_id} failed')
+
+
+class _TokenBucket:
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def delay(self, now: float) -> float:
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self):
+        self.tokens -= 1
+
+
+class _Chat:
+    def __init__(self, bucket: _TokenBucket):
+        self.bucket = bucket
+        self.busy = False
+        self.paused_until = 0
+
+
+class MessageScheduler:
+    """Sends outgoing messages by priority within the rate limits of Telegram
+
+    Every chat has its own token bucket, private chats and groups with their own limits, and all messages share a
+    global bucket, only chat actions do not need a token of their chat. Of all messages whose chat has a token the one
+    with the highest :class:`Priority` is sent first, messages of the same priority and chat in the order they were
+    scheduled. Only one message per chat is sent at a time. If Telegram answers with
+    :class:`telegram.error.RetryAfter` only the affected chat is paused and the message is sent again afterwards.
+
+    Args:
+        workers (:obj:`int`): How many messages are sent at the same time
+        global_rate (:obj:`float`): Messages per sec in all chats
+        private_rate (:obj:`float`): Messages per sec in a private chat
+        private_burst (:obj:`int`): Messages which can be sent at once in a private chat
+        group_rate (:obj:`float`): Messages per sec in a group or channel
+        group_burst (:obj:`int`): Messages which can be sent at once in a group or channel
+    """
+
+    def __init__(self, workers: int, global_rate: float, private_rate: float, private_burst: int, group_rate: float,
+                 group_burst: int):
+        self.workers = workers
+        self.private_rate = private_rate
+        self.private_burst = private_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+
+        self._global_bucket = _TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._queue = []
+        self._sequence = count()
+        self._in_flight = 0
+        self._retries = 0
+        self._metrics = {}
+        self._running = True
+        self._condition = Condition()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='message_scheduler')
+        self._thread = Thread(target=self._run, name='message_scheduler', daemon=True)
+        self._thread.start()
+
+    def schedule(self, function: Callable, args: tuple, kwargs: dict, chat_id: int or str, method: str,
+                 priority: int = None) -> ScheduledPromise:
+        """Schedule sending a message
+
+        Args:
+            function (:obj:`Callable`): Function sending the message
+            args (:obj:`tuple`): Positional arguments for the function
+            kwargs (:obj:`dict`): Keyword arguments for the function
+            chat_id (:obj:`int` or :obj:`str`): Chat the message is sent to
+            method (:obj:`str`): Name of the Bot API method like ``sendMessage``
+            priority (:obj:`int`, optional): One of :class:`Priority`, by default depending on the method
+
+        Returns:
+            :obj:`ScheduledPromise`: Promise of the result
+        """
+        if priority is None:
+            priority = Priority.METHODS.get(method, Priority.INTERACTIVE)
+
+        promise = ScheduledPromise(function, args, kwargs, chat_id, method, priority)
+        with self._condition:
+            insort(self._queue, (priority, next(self._sequence), promise))
+            self._condition.notify_all()
+        return promise
+
+    def stats(self) -> dict:
+        """Get the current state and metrics per method
+
+        Returns:
+            :obj:`dict`: The amount of ``queued`` and ``in_flight`` messages, ``paused_chats``, ``retries`` after
+                flood errors and per Bot API method in ``methods`` the amount sent (``count``), ``errors``, average
+                and maximum ``latency`` of the request and ``delay`` in the queue in sec
+        """
+        now = time.monotonic()
+        with self._condition:
+            methods = {}
+            for method, metrics in self._metrics.items():
+                methods[method] = {
+                    'count': metrics['count'],
+                    'errors': metrics['errors'],
+                    'latency_avg': metrics['latency'] / metrics['count'],
+                    'latency_max': metrics['latency_max'],
+                    'delay_avg': metrics['delay'] / metrics['count'],
+                    'delay_max': metrics['delay_max'],
+                }
+            return {
+                'queued': len(self._queue),
+                'in_flight': self._in_flight,
+                'paused_chats': len([chat for chat in self._chats.values() if chat.paused_until > now]),
+                'retries': self._retries,
+                'methods': methods,
+            }
+
+    def stop(self):
+        """Stop sending, messages still in the queue are not sent"""
+        with self._condition:
+            self._running = False
+            self._condition.notify_all()
+        self._executor.shutdown(wait=False)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                if not self._running:
+                    return
+                promise, wait = self._next()
+                if not promise:
+                    self._condition.wait(wait)
+                    continue
+                self._in_flight += 1
+            self._executor.submit(self._send, promise)
+
+    def _next(self) -> (ScheduledPromise or None, float or None):
+        if self._in_flight >= self.workers:
+            return None, None
+
+        now = time.monotonic()
+        wait = None
+        global_delay = self._global_bucket.delay(now)
+        for index, (_, _, promise) in enumerate(self._queue):
+            chat = self._chat(promise.chat_id)
+            if chat.busy:
+                continue
+
+            limited = promise.priority != Priority.ACTION
+            delay = max(global_delay, chat.paused_until - now, chat.bucket.delay(now) if limited else 0)
+            if delay <= 0:
+                del self._queue[index]
+                self._global_bucket.take()
+                if limited:
+                    chat.bucket.take()
+                chat.busy = True
+                return promise, None
+            wait = delay if wait is None else min(wait, delay)
+
+        self._prune_chats(now)
+        return None, wait
+
+    def _send(self, promise: ScheduledPromise):
+        try:
+            promise.run()
+        except RetryAfter as error:
+            logger.info(f'Flood control in chat {promise.chat_id}, pausing it for {error.retry_after} sec')
+            with self._condition:
+                self._chat(promise.chat_id).paused_until = time.monotonic() + error.retry_after
+                self._retries += 1
+                insort(self._queue, (promise.priority, next(self._sequence), promise))
+        else:
+            self._record(promise)
+        finally:
+            with self._condition:
+                self._chat(promise.chat_id).busy = False
+                self._in_flight -= 1
+                self._condition.notify_all()
+
+    def _record(self, promise: ScheduledPromise):
+        latency = time.monotonic() - promise.started_at
+        delay = promise.started_at - promise.queued_at
+        with self._condition:
+            metrics = self._metrics.setdefault(promise.method, {
+                'count': 0, 'errors': 0, 'latency': 0, 'latency_max': 0, 'delay': 0, 'delay_max': 0})
+            metrics['count'] += 1
+            metrics['errors'] += promise.exception is not None
+            metrics['latency'] += latency
+            metrics['latency_max'] = max(metrics['latency_max'], latency)
+            metrics['delay'] += delay
+            metrics['delay_max'] = max(metrics['delay_max'], delay)
+
+    def _chat(self, chat_id: int or str) -> _Chat:
+        chat = self._chats.get(chat_id, None)
+        if not chat:
+            # Private chats have positive ids, groups negative ones and channels may be given by their @username
+            if isinstance(chat_id, int) and chat_id > 0:
+                bucket = _TokenBucket(self.private_rate, self.private_burst)
+            else:
+                bucket = _TokenBucket(self.group_rate, self.group_burst)
+            chat = self._chats[chat_id] = _Chat(bucket)
+        return chat
+
+    def _prune_chats(self, now: float):
+        if len(self._chats) < 1000:
+            return
+        queued_chats = {promise.chat_id for _, _, promise in self._queue}
+        for chat_id, chat in list(self._chats.items()):
+            if (not chat.busy and chat.paused_until <= now and chat_id not in queued_chats
+                    and chat.bucket.delay(now) == 0 and chat.bucket.tokens >= chat.bucket.capacity):
+                del self._chats[chat_id]
@@ -0,0 +1,178 @@
+from datetime import datetime, timedelta
+from threading import RLock
+
+from PIL import Image
+from pymongo import ASCENDING
+from pymongo.collection import Collection
+
+__all__ = ['dhash', 'hamming_distance', 'PerceptualHashIndex']
+
+
+def dhash(image: str or Image.Image, hash_size: int = 8) -> int:
+    """Calculate the difference hash of an image
+
+    Similar images have hashes with a small hamming distance, which makes it possible to find near duplicates like
+    re-encoded or resized versions of the same image. See: http://www.hackerfactor.com/blog/?/archives/529-Kind-of-Like-That.html
+
+    Args:
+        image (:obj:`str` or :obj:`PIL.Image.Image`): Path to an image or a PIL Image
+        hash_size (:obj:`int`, optional): Width and height of the hash, the hash has ``hash_size ** 2`` bits
+
+    Returns:
+        :obj:`int`: The hash as integer
+    """
+    if isinstance(image, str):
+        with Image.open(image) as opened_image:
+            return dhash(opened_image, hash_size)
+
+    image = image.convert('L').resize((hash_size + 1, hash_size), Image.ANTIALIAS)
+    pixels = list(image.getdata())
+
+    value = 0
+    for row in range(hash_size):
+        row_start = row * (hash_size + 1)
+        for column in range(hash_size):
+            value = (value << 1) | (pixels[row_start + column] > pixels[row_start + column + 1])
+    return value
+
+
+def hamming_distance(first: int, second: int) -> int:
+    """Amount of bits differing between two hashes
+
+    Args:
+        first (:obj:`int`): A hash
+        second (:obj:`int`): Another hash
+
+    Returns:
+        :obj:`int`: The hamming distance
+    """
+    return bin(first ^ second).count('1')
+
+
+class PerceptualHashIndex:
+    """Index of perceptual image hashes for near duplicate lookups
+
+    The hashes are kept in memory in a multi-index hash table: Every hash is split into ``max_distance + 1`` chunks and
+    each chunk is indexed separately. Two hashes within ``max_distance`` must share at least one identical chunk, so a
+    lookup only has to compare the hashes found in these chunk tables instead of every known hash.
+
+    Every entry is persisted in a mongodb collection and expires after a given time.
+
+    Examples:
+        >>> index = PerceptualHashIndex(mongodb_database.some_collection)
+        >>> index.add(dhash('image.png'), {'image_url': 'https://...'}, timeout=3600)
+        >>> index.find(dhash('resized_image.jpg'))
+        >>> # {'image_url': 'https://...'}
+
+    Attributes:
+        collection (:obj:`pymongo.collection.Collection`): Collection the entries are persisted in
+        max_distance (:obj:`int`): Maximum hamming distance for two hashes to be considered the same image
+        hash_bits (:obj:`int`): Amount of bits of a hash
+
+    Args:
+        collection (:obj:`pymongo.collection.Collection`): Collection the entries are persisted in
+        max_distance (:obj:`int`, optional): Maximum hamming distance for two hashes to be considered the same image
+        hash_bits (:obj:`int`, optional): Amount of bits of a hash
+    """
+
+    def __init__(self, collection: Collection, max_distance: int = 4, hash_bits: int = 64):
+        self.collection = collection
+        self.max_distance = max_distance
+        self.hash_bits = hash_bits
+
+        chunk_count = max_distance + 1
+        self._chunks = []
+        start = 0
+        for index in range(chunk_count):
+            size = hash_bits // chunk_count + (1 if index < hash_bits % chunk_count else 0)
+            self._chunks.append((start, (1 << size) - 1))
+            start += size
+
+        self._tables = [{} for _ in self._chunks]
+        self._entries = {}
+        self._lock = RLock()
+        self._loaded = False
+
+    def __len__(self) -> int:
+        with self._lock:
+            self.load()
+            return len(self._entries)
+
+    def load(self):
+        """Load all not yet expired entries from the database if that has not yet happened"""
+        with self._lock:
+            if self._loaded:
+                return
+            self._loaded = True
+
+            self.collection.create_index([('hash', ASCENDING)], unique=True)
+            self.collection.create_index([('expires', ASCENDING)], expireAfterSeconds=0)
+
+            for document in self.collection.find({'expires': {'$gt': datetime.utcnow()}}):
+                self._insert(int(document['hash'], 16), document['data'], document['expires'])
+
+    def find(self, image_hash: int) -> dict or None:
+        """Find the entry of the most similar known image
+
+        Args:
+            image_hash (:obj:`int`): Hash of the image to look for
+
+        Returns:
+            :obj:`dict` or :obj:`None`: Data of the found entry, :obj:`None` if no similar image is known
+        """
+        with self._lock:
+            self.load()
+            now = datetime.utcnow()
+
+            candidates = set()
+            for table, chunk in zip(self._tables, self._chunk_values(image_hash)):
+                candidates.update(table.get(chunk, ()))
+
+            best_data, best_distance = None, self.max_distance + 1
+            for candidate in candidates:
+                distance = hamming_distance(image_hash, candidate)
+                if distance >= best_distance:
+                    continue
+                data, expires = self._entries[candidate]
+                if expires <= now:
+                    self._remove(candidate)
+                    continue
+                best_data, best_distance = data, distance
+            return best_data
+
+    def add(self, image_hash: int, data: dict, timeout: int):
+        """Add or replace an entry
+
+        Args:
+            image_hash (:obj:`int`): Hash of the image
+            data (:obj:`dict`): Data to store with the image, must be serializable by mongodb
+            timeout (:obj:`int`): After how much time the entry expires in sec
+        """
+        expires = datetime.utcnow() + timedelta(seconds=timeout)
+        hex_hash = '%0*x' % (self.hash_bits // 4, image_hash)
+
+        with self._lock:
+            self.load()
+            self._remove(image_hash)
+            self._insert(image_hash, data, expires)
+
+        self.collection.update_one({'hash': hex_hash},
+                                   {'$set': {'hash': hex_hash, 'data': data, 'expires': expires}},
+                                   upsert=True)
+
+    def _chunk_values(self, image_hash: int) -> list:
+        return [(image_hash >> start) & mask for start, mask in self._chunks]
+
+    def _insert(self, image_hash: int, data: dict, expires: datetime):
+        self._entries[image_hash] = (data, expires)
+        for table, chunk in zip(self._tables, self._chunk_values(image_hash)):
+            table.setdefault(chunk, set()).add(image_hash)
+
+    def _remove(self, image_hash: int):
+        if self._entries.pop(image_hash, None) is None:
+            return
+        for table, chunk in zip(self._tables, self._chunk_values(image_hash)):
+            hashes = table.get(chunk)
+            hashes.discard(image_hash)
+            if not hashes:
+                del table[chunk]
@@ -1,16 +1,90 @@
+import logging
+import time
+from threading import Lock
 from typing import Sized
 
 from emoji import emojize
 from telegram import Bot, ParseMode, Message
-from telegram.error import TimedOut
+from telegram.error import TelegramError
 from telegram.utils.promise import Promise
 
-__all__ = ['TelegramProgressBar']
+from xenian.bot.settings import PROGRESS_BAR
+from . import Priority, ScheduledPromise
+
+__all__ = ['TelegramProgressBar', 'ProgressBarSender', 'progress_bar_sender']
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressBarSender:
+    """Sends the edits of progress bars without waiting for Telegram
+
+    Every progress bar has at most one edit in flight. Only the latest text of a progress bar is kept while its edit is
+    being sent, so a progress bar which changes faster than its edits can be sent skips the texts in between. The next
+    edit is scheduled when the message scheduler finished the previous one, so a rate limited chat only delays its own
+    progress bars.
+    """
+
+    def __init__(self):
+        self._pending = {}
+        self._sending = set()
+        self._lock = Lock()
+
+    def submit(self, progress_bar: 'TelegramProgressBar', text: str):
+        """Send the text as the new state of the progress bar as soon as possible
+
+        Args:
+            progress_bar (:obj:`TelegramProgressBar`): The progress bar
+            text (:obj:`str`): The rendered progress bar
+        """
+        with self._lock:
+            if progress_bar in self._sending:
+                self._pending[progress_bar] = text
+                return
+            self._sending.add(progress_bar)
+        self._send(progress_bar, text)
+
+    def discard(self, progress_bar: 'TelegramProgressBar'):
+        """Drop the unsent state of a progress bar
+
+        Args:
+            progress_bar (:obj:`TelegramProgressBar`): The progress bar
+        """
+        with self._lock:
+            self._pending.pop(progress_bar, None)
+
+    def _send(self, progress_bar: 'TelegramProgressBar', text: str):
+        try:
+            result = progress_bar.edit_message(text)
+        except TelegramError as error:
+            logger.debug(f'Progress bar could not be updated: {error}')
+            result = None
+
+        if isinstance(result, ScheduledPromise):
+            result.add_done_callback(lambda _: self._sent(progress_bar))
+        else:
+            self._sent(progress_bar)
+
+    def _sent(self, progress_bar: 'TelegramProgressBar'):
+        with self._lock:
+            text = self._pending.pop(progress_bar, None)
+            if text is None:
+                self._sending.discard(progress_bar)
+                return
+        self._send(progress_bar, text)
+
+
+progress_bar_sender = ProgressBarSender()
+"""(:obj:`ProgressBarSender`): Sender used by all progress bars"""
 
 
 class TelegramProgressBar:
     """Create a progressbar for the Telegram user.
 
+    The message is only edited if at least PROGRESS_BAR['min_interval'] sec passed or the progress changed by
+    PROGRESS_BAR['min_delta'] since the last edit, and always when the progress is complete. The edits are sent by
+    :obj:`progress_bar_sender` without waiting for Telegram.
+
     Attributes:
         bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
         chat_id (:obj:`int`): Unique identifier of the chat with a user.
@@ -74,6 +148,10 @@ class TelegramProgressBar:
         self.current_step = 0
         self.started = False
 
+        self._last_text = None
+        self._last_percentage = 0
+        self._last_edit = 0
+
     @property
     def last_message(self) -> Message:
         if isinstance(self._last_message, Promise):
@@ -150,6 +228,8 @@ class TelegramProgressBar:
                                           se='\n' + self.se_message if self.se_message else '')
         message = message.format(current=self.current_step, total=self.full_amount, step_size=self.step_size)
         self.last_message = self.bot.send_message(self.chat_id, message, parse_mode=ParseMode.MARKDOWN)
+        self._last_text = message
+        self._last_edit = time.monotonic()
         self.started = True
 
     def update(self,
@@ -186,8 +266,15 @@ class TelegramProgressBar:
 
     def print_message(self):
         """Print message to user
+
+        The message is only edited if enough time passed or enough progress was made since the last edit.
         """
-        loaded_percentage = 1 / self.full_amount * self.current_step
+        loaded_percentage = min(1 / self.full_amount * self.current_step, 1)
+        now = time.monotonic()
+        if (loaded_percentage < 1 and now - self._last_edit < PROGRESS_BAR['min_interval']
+                and loaded_percentage - self._last_percentage < PROGRESS_BAR['min_delta']):
+            return
+
         loaded_chars_amount = round(self.line_width * loaded_percentage)
 
         bar = (self.loaded_char * loaded_chars_amount) + (self.unloaded_char * (self.line_width - loaded_chars_amount))
@@ -200,19 +287,34 @@ class TelegramProgressBar:
             current=round(self.current_step, 2),
             total=round(self.full_amount, 2),
             step_size=self.step_size)
-        if self.last_message:
-            if self.last_message.text == message:
-                return
-            try:
-                self.last_message = self.bot.edit_message_text(message, self.chat_id, self.last_message.message_id)
-            except TimedOut:
-                pass
+        if message == self._last_text:
+            return
+        self._last_text = message
+        self._last_percentage = loaded_percentage
+        self._last_edit = now
+
+        if self._last_message:
+            progress_bar_sender.submit(self, message)
             return
         self.last_message = self.bot.send_message(self.chat_id, message, parse_mode=ParseMode.MARKDOWN)
 
+    def edit_message(self, text: str) -> ScheduledPromise or Message or bool:
+        """Edit the message of the progressbar, does not wait for Telegram if the edit is scheduled
+
+        Args:
+            text (:obj:`str`): New text of the message
+
+        Returns:
+            :obj:`ScheduledPromise` or :obj:`telegram.message.Message` or :obj:`bool`: The scheduled edit or the result
+                of the edit if the bot sends directly
+        """
+        return self.bot.edit_message_text(text, self.chat_id, self.last_message.message_id,
+                                          priority=Priority.PROGRESS)
+
     def remove(self):
         """Remove your progressbar from Telegram.
         """
+        progress_bar_sender.discard(self)
         if self.last_message:
             self.bot.delete_message(self.chat_id, self.last_message.message_id)
 
@@ -0,0 +1,79 @@
+from io import BytesIO
+
+from PIL import Image
+
+from . import video_data_to_gif
+
+try:
+    from lottie.exporters.gif import export_gif
+    from lottie.parsers.tgs import parse_tgs
+except ImportError:
+    export_gif = parse_tgs = None
+
+__all__ = ['sticker_type', 'convert_sticker', 'STICKER_FORMATS']
+
+STICKER_FORMATS = ['png', 'webp']
+"""(:obj:`list`): Formats static stickers can be converted to"""
+
+_WEBM_MAGIC = b'\x1aE\xdf\xa3'
+_GZIP_MAGIC = b'\x1f\x8b'
+
+
+def sticker_type(data: bytes) -> str:
+    """Find out the type of a sticker by its content
+
+    Args:
+        data (:obj:`bytes`): The sticker file
+
+    Returns:
+        :obj:`str`: ``tgs`` for animated, ``webm`` for video and ``static`` for normal stickers
+    """
+    if data.startswith(_GZIP_MAGIC):
+        return 'tgs'
+    if data.startswith(_WEBM_MAGIC):
+        return 'webm'
+    return 'static'
+
+
+def convert_sticker(data: bytes, format: str = 'png', compress_level: int = 6) -> (bytes, str):
+    """Convert a sticker in memory
+
+    Static stickers are converted to the given format. Animated (``.tgs``) and video (``.webm``) stickers are
+    converted to gifs, animated stickers need the optional ``lottie`` package with ``cairosvg`` for that.
+
+    Args:
+        data (:obj:`bytes`): The sticker file
+        format (:obj:`str`, optional): Format of static stickers, one of :obj:`STICKER_FORMATS`
+        compress_level (:obj:`int`, optional): Compression effort, 0 - 9 for png and 0 - 6 for lossless webp
+
+    Returns:
+        :obj:`tuple`: The converted sticker and its file extension like ``.png``
+
+    Raises:
+        ValueError: If the format is not supported
+        RuntimeError: If an animated sticker is given but ``lottie`` is not installed
+        subprocess.CalledProcessError: If ffmpeg could not convert a video sticker
+    """
+    kind = sticker_type(data)
+    if kind == 'tgs':
+        if parse_tgs is None:
+            raise RuntimeError('Animated stickers can only be converted if lottie is installed')
+        output = BytesIO()
+        export_gif(parse_tgs(BytesIO(data)), output)
+        return output.getvalue(), '.gif'
+
+    if kind == 'webm':
+        # The native vp9 decoder of ffmpeg drops the alpha channel, libvpx keeps it
+        return video_data_to_gif(data, input_options=['-c:v', 'libvpx-vp9']), '.gif'
+
+    if format not in STICKER_FORMATS:
+        raise ValueError(f'Stickers can not be converted to {format}, use one of {", ".join(STICKER_FORMATS)}')
+
+    output = BytesIO()
+    with Image.open(BytesIO(data)) as image:
+        image = image.convert('RGBA')
+        if format == 'webp':
+            image.save(output, 'webp', lossless=True, method=min(compress_level, 6))
+        else:
+            image.save(output, 'png', compress_level=compress_level)
+    return output.getvalue(), '.' + format
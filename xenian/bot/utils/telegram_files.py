@@ -1,13 +1,23 @@
+import hashlib
+import json
 import os
-from contextlib import contextmanager
+import shutil
+import subprocess
+import time
+from concurrent.futures import Executor
+from contextlib import ExitStack, contextmanager
 from tempfile import NamedTemporaryFile
+from typing import Callable
 
-from PIL import Image
+import requests
 from imageio.core import NeedDownloadError
 from imageio import plugins
-from telegram import Bot, Update, Message
+from telegram import Bot, Document, File, Message, Sticker, Update, Video
 
-from . import CustomNamedTemporaryFile
+from xenian.bot.settings import (ARTIFACT_CACHE, GIF_CONVERSION, GIF_OPTIMIZATION, MEDIA_CACHE,
+                                 REVERSE_IMAGE_SEARCH_FIRST_FRAME, STICKER_CONVERSION)
+from . import FileCache, TimeoutCache, convert_sticker, convert_video_to_gif, download_telegram_file, \
+    extract_first_keyframe, local_file_path, optimize_gif, sticker_type, telegram_file_bytes
 
 try:
     from moviepy.video.io.VideoFileClip import VideoFileClip
@@ -18,7 +28,220 @@ except NeedDownloadError as error:
         raise error
 
 __all__ = ['image_download', 'sticker_download', 'video_download', 'video_to_gif', 'video_to_gif_download',
-           'auto_download']
+           'auto_download', 'get_file', 'cached_download', 'cached_artifact', 'gif_from_video', 'sticker_to_png',
+           'sticker_to_image', 'compress_gif', 'media_cache', 'artifact_cache']
+
+media_cache = FileCache(MEDIA_CACHE['path'], MEDIA_CACHE['max_bytes'])
+"""(:obj:`FileCache`): Downloaded Telegram files by their file_unique_id"""
+
+artifact_cache = FileCache(ARTIFACT_CACHE['path'], ARTIFACT_CACHE['max_bytes'])
+"""(:obj:`FileCache`): Files derived from Telegram files like converted GIFs, by file_unique_id, transform and
+parameters"""
+
+_get_file_cache = TimeoutCache(timeout=55 * 60, max_size=1024)
+
+
+def get_file(bot: Bot, file_id: str) -> File:
+    """Get a file from Telegram
+
+    The result is reused as long as the download link is valid, which Telegram guarantees for at least one hour.
+
+    Args:
+        bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+        file_id (:obj:`str`): Identifier of the file
+
+    Returns:
+        :obj:`telegram.file.File`: The file object with a download link
+    """
+    return _get_file_cache.get_or_set(file_id, lambda: bot.get_file(file_id))
+
+
+@contextmanager
+def cached_download(bot: Bot, telegram_object, suffix: str = None):
+    """Download a file from Telegram through the shared media cache
+
+    Args:
+        bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+        telegram_object: Any Telegram object with a file_id and file_unique_id like
+            :obj:`telegram.photosize.PhotoSize`, :obj:`telegram.sticker.Sticker`, :obj:`telegram.video.Video` or
+            :obj:`telegram.document.Document`
+        suffix (:obj:`str`, optional): Suffix of the file like ``.mp4``, taken from the file name if not given
+
+    Returns:
+        :obj:`str`: Path to the downloaded file, the file must not be modified
+    """
+    if suffix is None:
+        suffix = os.path.splitext(getattr(telegram_object, 'file_name', None) or '')[1]
+
+    def download(path):
+        download_telegram_file(get_file(bot, telegram_object.file_id), path)
+
+    with media_cache.get(telegram_object.file_unique_id, download, suffix) as path:
+        yield path
+
+
+@contextmanager
+def cached_artifact(file_unique_id: str, transform: str, create: Callable[[str], None], suffix: str = '',
+                    params: dict = None):
+    """Get a file derived from a Telegram file through the shared artifact cache
+
+    Examples:
+        >>> def create(path):
+        >>>     with cached_download(bot, sticker) as sticker_path:
+        >>>         Image.open(sticker_path).save(path, 'png')
+        >>>
+        >>> with cached_artifact(sticker.file_unique_id, 'png', create, '.png') as png_path:
+        >>>     ...
+
+    Args:
+        file_unique_id (:obj:`str`): Unique identifier of the Telegram file the artifact is derived from
+        transform (:obj:`str`): Name of the conversion like ``gif``
+        create (:obj:`Callable`): Called with a path only if the artifact is not cached yet, must write the artifact
+            to this path
+        suffix (:obj:`str`, optional): Suffix of the artifact like ``.gif``
+        params (:obj:`dict`, optional): JSON serializable parameters of the conversion, artifacts created with other
+            parameters are cached separately
+
+    Returns:
+        :obj:`str`: Path to the artifact, the file must not be modified
+    """
+    params_hash = hashlib.sha1(json.dumps(params or {}, sort_keys=True).encode()).hexdigest()[:12]
+    key = f'{file_unique_id}-{transform}-{params_hash}'
+
+    with artifact_cache.get(key, create, suffix) as path:
+        yield path
+
+
+@contextmanager
+def gif_from_video(bot: Bot, document: Document or Video):
+    """Convert a Telegram video to a gif and a compressed gif through the artifact cache
+
+    Args:
+        bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+        document (:obj:`telegram.document.Document` or :obj:`telegram.video.Video`): The video
+
+    Returns:
+        :obj:`tuple`: Path to the gif and path to the compressed gif or :obj:`None` if it could not be compressed
+    """
+    def create_gif(path):
+        with cached_download(bot, document, '.mp4') as video_path:
+            convert_video_to_gif(video_path, path, **GIF_CONVERSION)
+
+    with ExitStack() as stack:
+        gif_path = stack.enter_context(cached_artifact(document.file_unique_id, 'gif', create_gif, '.gif',
+                                                       GIF_CONVERSION))
+
+        def create_compressed_gif(path):
+            with cached_download(bot, document, '.mp4') as video_path:
+                if not compress_gif(video_path, gif_path, path):
+                    # An empty artifact caches that the gif is too big, so it is not compressed again every time
+                    open(path, 'wb').close()
+
+        try:
+            compressed_gif_path = stack.enter_context(cached_artifact(
+                document.file_unique_id, 'gif_min', create_compressed_gif, '.gif',
+                {'conversion': GIF_CONVERSION, 'max_bytes': GIF_OPTIMIZATION['max_bytes']}))
+        except OSError:
+            compressed_gif_path = None
+        if compressed_gif_path and not os.path.getsize(compressed_gif_path):
+            compressed_gif_path = None
+
+        yield gif_path, compressed_gif_path
+
+
+def compress_gif(video_path: str, gif_path: str, output_path: str) -> bool:
+    """Compress a gif converted from a video to the best quality below the size defined in GIF_OPTIMIZATION
+
+    If no gifsicle settings are small enough the video is converted again with half the fps as last resort.
+
+    Args:
+        video_path (:obj:`str`): Path to the video the gif was converted from
+        gif_path (:obj:`str`): Path to the gif
+        output_path (:obj:`str`): Path where the compressed gif is saved to
+
+    Returns:
+        :obj:`bool`: True if the gif could be compressed below the maximum size
+    """
+    deadline = time.monotonic() + GIF_OPTIMIZATION['time_budget']
+    options = {'max_bytes': GIF_OPTIMIZATION['max_bytes'], 'workers': GIF_OPTIMIZATION['workers']}
+
+    if optimize_gif(gif_path, output_path, time_budget=GIF_OPTIMIZATION['time_budget'], **options):
+        return True
+    if not GIF_CONVERSION.get('fps') or time.monotonic() >= deadline:
+        return False
+
+    with NamedTemporaryFile(suffix='.gif') as low_fps_gif:
+        convert_video_to_gif(video_path, low_fps_gif.name, fps=GIF_CONVERSION['fps'] / 2,
+                             max_width=GIF_CONVERSION.get('max_width'))
+        return optimize_gif(low_fps_gif.name, output_path, time_budget=deadline - time.monotonic(), **options)
+
+
+@contextmanager
+def sticker_to_image(bot: Bot, sticker: Sticker, executor: Executor = None):
+    """Convert a sticker through the artifact cache
+
+    Static stickers are converted to the format given in STICKER_CONVERSION, animated and video stickers to gifs. The
+    sticker is downloaded into memory, only video stickers are written to a temporary file for the two ffmpeg passes.
+
+    Args:
+        bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+        sticker (:obj:`telegram.sticker.Sticker`): The sticker
+        executor (:obj:`concurrent.futures.Executor`, optional): Executor the conversion runs in like a process pool,
+            by default it runs in the current thread. Video stickers are always converted in the current thread.
+
+    Returns:
+        :obj:`tuple`: Path to the image and its file extension like ``.png``
+    """
+    def create(path):
+        data = telegram_file_bytes(get_file(bot, sticker.file_id))
+        # Video stickers are converted by ffmpeg in this thread, so the process is killed if the job is cancelled
+        if executor and sticker_type(data) != 'webm':
+            image, _ = executor.submit(convert_sticker, data, **STICKER_CONVERSION).result()
+        else:
+            image, _ = convert_sticker(data, **STICKER_CONVERSION)
+        with open(path, 'wb') as image_file:
+            image_file.write(image)
+
+    with cached_artifact(sticker.file_unique_id, 'sticker', create, params=STICKER_CONVERSION) as image_path:
+        yield image_path, _image_extension(image_path)
+
+
+@contextmanager
+def sticker_to_png(bot: Bot, sticker: Sticker):
+    """Convert a sticker to a static png through the artifact cache
+
+    The thumbnail is used for animated and video stickers.
+
+    Args:
+        bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+        sticker (:obj:`telegram.sticker.Sticker`): The sticker
+
+    Returns:
+        :obj:`str`: Path to the png
+    """
+    def create(path):
+        data = telegram_file_bytes(get_file(bot, sticker.file_id))
+        if sticker_type(data) != 'static':
+            if not sticker.thumb:
+                raise ValueError('The sticker is animated and has no thumbnail')
+            data = telegram_file_bytes(get_file(bot, sticker.thumb.file_id))
+
+        image, _ = convert_sticker(data, 'png')
+        with open(path, 'wb') as image_file:
+            image_file.write(image)
+
+    with cached_artifact(sticker.file_unique_id, 'png', create, '.png') as png_path:
+        yield png_path
+
+
+def _image_extension(image_path: str) -> str:
+    with open(image_path, 'rb') as image_file:
+        header = image_file.read(12)
+    if header.startswith(b'GIF8'):
+        return '.gif'
+    if header.startswith(b'RIFF') and header[8:12] == b'WEBP':
+        return '.webp'
+    return '.png'
 
 
 @contextmanager
@@ -37,18 +260,103 @@ def video_to_gif_download(bot: Bot, message: Message):
     Returns:
         :obj:`str`: Path to gif file
     """
-    with video_download(bot, message) as video_path:
-        with video_to_gif(video_path) as gif_path:
-            yield gif_path
+    with gif_from_video(bot, message.document or message.video) as (gif_path, compressed_gif_path):
+        yield compressed_gif_path or gif_path
 
 
 @contextmanager
 def first_frame_from_video(bot: Bot, message: Message):
+    """Get the first frame of a video or gif
+
+    To prevent downloading whole videos the first frame is retrieved in this order:
+    1. The thumbnail Telegram created, if it is large enough
+    2. The first keyframe found in the beginning of the video
+    3. The first frame of the fully downloaded video
+
+    Args:
+        bot (:obj:`telegram.bot.Bot`): Telegram Api Bot Object.
+        message (:obj:`telegram.message.Message`): Telegram Api Message Object
+
+    Returns:
+        :obj:`str`: Path to image file
+    """
+    document = message.document or message.video
+
+    def create(path):
+        with _first_frame_from_video(bot, message) as image_path:
+            shutil.copyfile(image_path, path)
+
+    with cached_artifact(document.file_unique_id, 'first_frame', create, '.jpg') as image_path:
+        yield image_path
+
+
+@contextmanager
+def _first_frame_from_video(bot: Bot, message: Message):
+    document = message.document or message.video
+    # Only thumbnails of videos and GIFs show their first frame, those of other documents may be anything
+    mime_type = getattr(document, 'mime_type', None) or ''
+    is_video = bool(message.video or message.animation) or mime_type.startswith('video/') or mime_type == 'image/gif'
+    thumb = getattr(document, 'thumb', None) if is_video else None
+
+    if document.file_unique_id in media_cache:
+        with video_download(bot, message) as video_path:
+            with extract_first_frame(video_path) as image_path:
+                yield image_path
+        return
+
+    if thumb and max(thumb.width, thumb.height) >= REVERSE_IMAGE_SEARCH_FIRST_FRAME['min_thumbnail_edge']:
+        with cached_download(bot, thumb, '.jpg') as image_path:
+            yield image_path
+        return
+
+    found_frame = False
+    with NamedTemporaryFile(suffix='.mp4') as video_file, NamedTemporaryFile(suffix='.jpg') as jpg_file:
+        try:
+            partial_download(get_file(bot, document.file_id), video_file,
+                             REVERSE_IMAGE_SEARCH_FIRST_FRAME['partial_download_bytes'])
+            found_frame = extract_first_keyframe(video_file.name, jpg_file.name)
+        except (requests.RequestException, OSError, subprocess.CalledProcessError, subprocess.TimeoutExpired):
+            # Fall back to the full download below
+            pass
+        if found_frame:
+            yield jpg_file.name
+    if found_frame:
+        return
+
     with video_download(bot, message) as video_path:
         with extract_first_frame(video_path) as image_path:
             yield image_path
 
 
+def partial_download(telegram_file: File, out, max_bytes: int):
+    """Download only the beginning of a file
+
+    Args:
+        telegram_file (:obj:`telegram.file.File`): File to download
+        out: Writable file like object
+        max_bytes (:obj:`int`): Maximum amount of bytes to download
+    """
+    local_path = local_file_path(telegram_file)
+    if local_path:
+        with open(local_path, 'rb') as file:
+            out.write(file.read(max_bytes))
+        out.flush()
+        return
+
+    response = requests.get(telegram_file.file_path, headers={'Range': f'bytes=0-{max_bytes - 1}'}, stream=True,
+                            timeout=20)
+    response.raise_for_status()
+
+    downloaded = 0
+    for chunk in response.iter_content(chunk_size=65536):
+        out.write(chunk[:max_bytes - downloaded])
+        downloaded += len(chunk)
+        if downloaded >= max_bytes:
+            break
+    response.close()
+    out.flush()
+
+
 @contextmanager
 def extract_first_frame(video_path: str):
     video_clip = VideoFileClip(video_path, audio=False)
@@ -67,18 +375,11 @@ def video_to_gif(video_path: str):
     Returns:
         :obj:`str`: Path to gif file
     """
-    video_clip = VideoFileClip(video_path, audio=False)
-
-    with NamedTemporaryFile(suffix='.gif') as gif_file:
-        video_clip.write_gif(gif_file.name)
-
-        dirname = os.path.dirname(gif_file.name)
-        file_name = os.path.splitext(gif_file.name)[0]
-        compressed_gif_path = os.path.join(dirname, file_name + '-min.gif')
+    with NamedTemporaryFile(suffix='.gif') as gif_file, NamedTemporaryFile(suffix='-min.gif') as compressed_gif_file:
+        convert_video_to_gif(video_path, gif_file.name, **GIF_CONVERSION)
 
-        os.system('gifsicle -O3 --lossy=50 -o {dst} {src}'.format(dst=compressed_gif_path, src=gif_file.name))
-        if os.path.isfile(compressed_gif_path):
-            yield compressed_gif_path
+        if compress_gif(video_path, gif_file.name, compressed_gif_file.name):
+            yield compressed_gif_file.name
         else:
             yield gif_file.name
 
@@ -95,12 +396,9 @@ def video_download(bot: Bot, message: Message):
         :obj:`str`: Path to gif file
     """
     document = message.document or message.video
-    video = bot.getFile(document.file_id)
 
-    with NamedTemporaryFile(suffix='.mp4') as video_file:
-        video.download(video_file.name)
-
-        yield video_file.name
+    with cached_download(bot, document, '.mp4') as video_path:
+        yield video_path
 
 
 @contextmanager
@@ -115,15 +413,8 @@ def sticker_download(bot: Bot, message: Message):
     Returns:
         :obj:`str`: Path to image file
     """
-    sticker_image = bot.getFile(message.sticker.file_id)
-
-    with CustomNamedTemporaryFile(suffix='.png') as image_file:
-        sticker_image.download(out=image_file)
-        image_file.close()
-        pil_image = Image.open(image_file.name).convert("RGBA")
-        pil_image.save(image_file.name, 'png')
-
-        yield image_file.name
+    with sticker_to_png(bot, message.sticker) as image_path:
+        yield image_path
 
 
 @contextmanager
@@ -138,10 +429,8 @@ def image_download(bot: Bot, message: Message):
     Returns:
         :obj:`str`: Path to image file
     """
-    photo = bot.getFile(message.photo[-1].file_id)
-    with NamedTemporaryFile(suffix='.png') as image_file:
-        photo.download(out=image_file)
-        yield image_file.name
+    with cached_download(bot, message.photo[-1], '.jpg') as image_path:
+        yield image_path
 
 
 @contextmanager
@@ -0,0 +1,122 @@
+import os
+import subprocess
+from tempfile import TemporaryDirectory
+
+from moviepy.config import get_setting
+from moviepy.video.io.ffmpeg_reader import ffmpeg_parse_infos
+
+from . import run_process
+
+__all__ = ['ffmpeg_binary', 'extract_first_keyframe', 'convert_video_to_gif', 'video_data_to_gif']
+
+
+def ffmpeg_binary() -> str:
+    """Get the ffmpeg binary which is used by moviepy as well
+
+    Returns:
+        :obj:`str`: Path to the ffmpeg binary
+    """
+    return get_setting('FFMPEG_BINARY')
+
+
+def extract_first_keyframe(video_path: str, image_path: str, timeout: float = 30) -> bool:
+    """Save the first keyframe of a video as image
+
+    Only keyframes are decoded, so this works on the start of a video even if the rest of the file is missing.
+
+    Args:
+        video_path (:obj:`str`): Path to the video
+        image_path (:obj:`str`): Path where the image is saved to, the extension defines the image format
+        timeout (:obj:`float`, optional): Kill ffmpeg after this many sec
+
+    Returns:
+        :obj:`bool`: True if a frame could be extracted
+
+    Raises:
+        FileNotFoundError: If ffmpeg is not installed
+        subprocess.TimeoutExpired: If ffmpeg took longer than ``timeout``
+    """
+    result = run_process(
+        [ffmpeg_binary(), '-v', 'error', '-y', '-skip_frame', 'nokey', '-i', video_path, '-frames:v', '1',
+         '-f', 'image2', image_path],
+        timeout=timeout, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode == 0 and os.path.isfile(image_path) and os.path.getsize(image_path) > 0
+
+
+def convert_video_to_gif(video_path: str, gif_path: str, fps: int or float = None, max_width: int = None):
+    """Convert a video to a gif with ffmpeg
+
+    The conversion runs in two passes: The first one generates a palette optimized for the video into a small png, the
+    second one applies it while encoding the gif. Frames are streamed in both passes, so memory use does not grow with
+    the length of the video, and they never leave ffmpeg, which is much faster than decoding them in python like
+    moviepy does.
+
+    Args:
+        video_path (:obj:`str`): Path to the video
+        gif_path (:obj:`str`): Path where the gif is saved to
+        fps (:obj:`int` or :obj:`float`, optional): Maximum frames per second, videos with less fps keep their fps
+        max_width (:obj:`int`, optional): Maximum width in px, smaller videos are not upscaled
+
+    Raises:
+        subprocess.CalledProcessError: If ffmpeg could not convert the video
+        JobCancelled: If the job of the current thread was cancelled
+    """
+    if fps:
+        fps = min(fps, ffmpeg_parse_infos(video_path).get('video_fps') or fps)
+
+    _two_pass_gif(video_path, gif_path, fps, max_width)
+
+
+def video_data_to_gif(data: bytes, input_options: list = None, max_width: int = None) -> bytes:
+    """Convert a video in memory to a gif with ffmpeg
+
+    Works like :func:`convert_video_to_gif` but the fps is kept, as it is not known before reading the video. The video
+    is written to a temporary file, as both passes have to read it.
+
+    Args:
+        data (:obj:`bytes`): The video
+        input_options (:obj:`list`, optional): Additional ffmpeg options for the input like ``['-c:v', 'libvpx-vp9']``
+        max_width (:obj:`int`, optional): Maximum width in px, smaller videos are not upscaled
+
+    Returns:
+        :obj:`bytes`: The gif
+
+    Raises:
+        subprocess.CalledProcessError: If ffmpeg could not convert the video
+        JobCancelled: If the job of the current thread was cancelled
+    """
+    with TemporaryDirectory() as temp_dir:
+        video_path = os.path.join(temp_dir, 'video')
+        gif_path = os.path.join(temp_dir, 'video.gif')
+        with open(video_path, 'wb') as video_file:
+            video_file.write(data)
+
+        _two_pass_gif(video_path, gif_path, None, max_width, input_options)
+        with open(gif_path, 'rb') as gif_file:
+            return gif_file.read()
+
+
+def _two_pass_gif(video_path: str, gif_path: str, fps: int or float or None, max_width: int or None,
+                  input_options: list = None):
+    filters = []
+    if fps:
+        filters.append(f'fps={fps}')
+    if max_width:
+        filters.append(f"scale='min({max_width},iw)':-1:flags=lanczos")
+
+    if filters:
+        paletteuse_graph = f'[0:v]{",".join(filters)}[frames];[frames][1:v]'
+    else:
+        paletteuse_graph = '[0:v][1:v]'
+    paletteuse_graph += 'paletteuse=dither=bayer:bayer_scale=5:diff_mode=rectangle'
+
+    with TemporaryDirectory() as temp_dir:
+        palette_path = os.path.join(temp_dir, 'palette.png')
+        run_process(
+            [ffmpeg_binary(), '-v', 'error', '-y', *(input_options or []), '-i', video_path, '-an',
+             '-vf', ','.join(filters + ['palettegen=stats_mode=diff']), palette_path],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)
+        run_process(
+            [ffmpeg_binary(), '-v', 'error', '-y', *(input_options or []), '-i', video_path, '-i', palette_path,
+             '-an', '-lavfi', paletteuse_graph, '-f', 'gif', gif_path],
+            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, check=True)